@@ -1,31 +1,135 @@
 # -*- coding: utf-8 -*-
-from tides import Tides
-from astro import Astro
-from cal_draw import generate_annual_calendar
+from tides import Tides, nearest_stations
+from astro import build_astros
+from cache import DiskCache
+from cal_draw import generate_annual_calendar, render_pages
 import argparse
 import os
+import sys
 
-parser = argparse.ArgumentParser()
-parser.add_argument('filename',
-                    help = 'Path to a NOAA annual tide tables text file.')
-args = parser.parse_args()
 
-if not os.path.isfile(args.filename):
-    raise IOError('Cannot find {}'.format(args.filename))
-print('Making Sun * Moon * Tide Calendar with input file \
+def list_nearest(argv):
+    """subcommand: python sunmoontide nearest LATITUDE LONGITUDE"""
+    parser = argparse.ArgumentParser(prog = 'sunmoontide nearest',
+        description = 'List the NOAA tide prediction stations nearest to a \
+location.')
+    parser.add_argument('latitude', type = float,
+                        help = 'Latitude in decimal degrees, e.g. 36.96')
+    parser.add_argument('longitude', type = float,
+                        help = 'Longitude in decimal degrees, e.g. -122.02')
+    parser.add_argument('-k', type = int, default = 5,
+                        help = 'Number of stations to list (default 5).')
+    parser.add_argument('--radius', type = float, default = None,
+                        help = 'Only list stations within this many km.')
+    args = parser.parse_args(argv)
+    for st in nearest_stations(args.latitude, args.longitude, args.k,
+                               args.radius):
+        print('{st_id:>8}  {distance_km:8.1f} km  {name}, {state} \
+({st_type})'.format(**st))
+
+
+def _print_pages_cache(pages_cache):
+    if pages_cache is not None:
+        print('Page cache: {hits} pages reused, {misses} drawn.'.format(
+            **pages_cache.stats()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename',
+                        help = 'Path to a NOAA annual tide tables text file \
+(plain, .gz or .zip), or - to read it from standard input.')
+    parser.add_argument('--adaptive', action = 'store_true',
+                        help = 'Sample sun and moon altitudes adaptively \
+rather than every 10 minutes: faster, with the same curves above the horizon.')
+    parser.add_argument('--processes', type = int, default = 1,
+                        help = 'Number of processes for the sun and moon \
+calculations (default 1; 0 = one per CPU).')
+    parser.add_argument('--render-processes', type = int, default = 1,
+                        help = 'Number of processes drawing calendar pages \
+in parallel (default 1; 0 = one per CPU). Each page is then a separate PDF \
+with its own copy of the fonts, so the merged calendar is a few percent \
+larger (as with --cache), and starting the workers can cost more than it \
+saves on machines with few cores.')
+    parser.add_argument('--profile', choices = ['print', 'screen', 'full'],
+                        default = None,
+                        help = 'How finely to draw the sun, moon and tide \
+curves: print (default for pdf), screen for a smaller file to view on screen \
+(default for other formats), or full to draw every sample.')
+    parser.add_argument('--format', choices = ['pdf', 'png', 'webp', 'svg'],
+                        default = 'pdf',
+                        help = 'pdf (default) for the printable calendar, or \
+png, webp or svg for a preview file of each page, without the front and \
+back matter.')
+    parser.add_argument('--dpi', type = int, default = 100,
+                        help = 'Resolution of png and webp pages, in dots per \
+inch (default 100).')
+    parser.add_argument('--month', action = 'append', default = None,
+                        metavar = 'YYYY-MM',
+                        help = 'Draw only this month page, e.g. 2015-07, as a \
+file in the chosen format (pdf by default). May be given more than once.')
+    parser.add_argument('--ephemeris', action = 'store_true',
+                        help = 'Compute sun and moon altitudes from a yearly \
+Chebyshev ephemeris, built once and cached: several times faster, and within \
+1e-5 radians.')
+    parser.add_argument('--cache', action = 'store_true',
+                        help = 'Keep tide and sun/moon results and calendar \
+pages in a cache directory ($SUNMOONTIDE_CACHE, default \
+~/.cache/sunmoontide) and reuse them in later runs: sun/moon results also for \
+stations within about 10 km, pages only if nothing they show has changed.')
+    args = parser.parse_args()
+
+    if args.filename != '-' and not os.path.isfile(args.filename):
+        raise IOError('Cannot find {}'.format(args.filename))
+    print('Making Sun * Moon * Tide Calendar with input file \
 {}.'.format(args.filename))
 
-tides = Tides(args.filename)
-print('{}, {}'.format(tides.station_name, tides.state))
-sun = Astro(str(tides.latitude), str(tides.longitude),
-            tides.timezone, tides.year, 'Sun')
-print('Sun calculations complete.')
-moon = Astro(str(tides.latitude), str(tides.longitude),
-             tides.timezone, tides.year, 'Moon')
-print('Moon calculations complete.')
-
-print('Starting to draw calendar now.')
-output_filename = 'SunMoonTide_{}_{}.pdf'.format(tides.year, tides.station_id)
-generate_annual_calendar(tides, sun, moon, output_filename)
-print('Calendar complete. Find output `{}` in the current working \
+    tides_cache = DiskCache('tides') if args.cache else None
+    astro_cache = DiskCache('astro') if args.cache else None
+    pages_cache = DiskCache('pages') if args.cache else None
+    tides = Tides(args.filename, cache = tides_cache)
+    print('{}, {}'.format(tides.station_name, tides.state))
+    sun, moon = build_astros(str(tides.latitude), str(tides.longitude),
+                             tides.timezone, tides.year, ('Sun', 'Moon'),
+                             processes = args.processes or None,
+                             adaptive = args.adaptive, cache = astro_cache,
+                             ephemeris = args.ephemeris or None)
+    print('Sun and Moon calculations complete.')
+    if astro_cache is not None:
+        print('Sun and Moon cache: {hits} hits, {misses} misses.'.format(
+            **astro_cache.stats()))
+
+    if args.format != 'pdf' or args.month:
+        print('Drawing calendar pages now.')
+        if args.format == 'pdf':   # as in the calendar, and its cached pages
+            default_profile, dpi = 'print', None
+        else:
+            default_profile, dpi = 'screen', args.dpi
+        render_pages(tides, sun, moon, pages = args.month,
+                     format = args.format, dpi = dpi, directory = '.',
+                     processes = args.render_processes or None,
+                     profile = args.profile or default_profile,
+                     cache = pages_cache)
+        _print_pages_cache(pages_cache)
+        print('Calendar pages complete.')
+        return
+
+    print('Starting to draw calendar now.')
+    output_filename = 'SunMoonTide_{}_{}.pdf'.format(tides.year,
+                                                     tides.station_id)
+    generate_annual_calendar(tides, sun, moon, output_filename,
+                             processes = args.render_processes or None,
+                             profile = args.profile or 'print',
+                             cache = pages_cache)
+    _print_pages_cache(pages_cache)
+    print('Calendar complete. Find output `{}` in the current working \
 directory.'.format(output_filename))
+
+
+# worker processes (see astro.build_astros) may import this module; only the
+# main process runs the program
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['nearest']:
+        list_nearest(sys.argv[2:])
+    else:
+        main()
@@ -8,10 +8,15 @@ be useful in other applications.
 
 import datetime
 import ephem
+import multiprocessing
 import numpy as np
 import pandas as pd
 import pytz
 
+from cache import DiskCache, content_key
+from ephemeris import ChebyshevEphemeris, topocentric_altitudes
+from intervals import level_crossings, intervals_above, _secant
+
 def round_datetime(dt):
    """Round a datetime object to the closest minute.
    Argument: dt - a datetime.datetime object.
@@ -104,7 +109,14 @@ def utc_year_bounds(time_zone, year):
     return begin_result, end_result
 
 
-def fill_in_heights(start, stop, step, observe, body_name, append_NaN = True):
+# Upper bound on how fast any body's apparent altitude can change, in radians
+# per day: Earth's rotation (2 pi) plus the Moon's own motion, with margin for
+# refraction near the horizon.
+MAX_ALTITUDE_RATE = 8.0
+
+
+def fill_in_heights(start, stop, step, observe, body_name, append_NaN = True,
+                    adaptive = False, coarse_steps = 12, tolerance = 0.002):
     """Return sequential lists of times and heights between start and stop
     times, at given time step, for an astronomical body's altitude over time.
     
@@ -121,6 +133,14 @@ def fill_in_heights(start, stop, step, observe, body_name, append_NaN = True):
         append_NaN (Boolean, default = True): if True, append a NaN value to
             the end of the result, to provide breaks between plotted line
             segments.
+        adaptive (Boolean, default = False): if True, sample only the times
+            needed to draw the visible (above horizon) part of the curve,
+            instead of every `step`; see `adaptive_heights`.
+        coarse_steps (int, default = 12): adaptive only; spacing of the coarse
+            grid, in steps
+        tolerance (float, default = 0.002): adaptive only; largest allowed
+            altitude error (radians) of straight lines between samples, as
+            measured at their midpoints
     
     Returns:
         times, heights
@@ -147,31 +167,147 @@ def fill_in_heights(start, stop, step, observe, body_name, append_NaN = True):
     2015-05-15 20:00 ...   0.951
     2015-05-15 20:00 ...     nan
     """
+    if adaptive:
+        times, heights = adaptive_heights(start, stop, step, observe,
+                                          body_name, coarse_steps, tolerance)
+        if append_NaN:
+            times.append(ephem.Date(stop + step/100).datetime())
+            heights.append(float('NaN'))
+        return times, heights
+
+    times, heights = fill_in_heights_multi(start, stop, step, observe,
+                                           [body_name], append_NaN)
+    return times, heights[body_name]
+
+
+def fill_in_heights_multi(start, stop, step, observe, body_names,
+                          append_NaN = True):
+    """Like `fill_in_heights`, for several bodies in one pass over the time
+    grid: the observer moves to each time once, and every body is computed
+    for it.
+
+    Arguments are as for fill_in_heights, except
+        body_names (list of str): title-case ephem body names, i.e.
+            ['Sun', 'Moon', 'Venus', 'Mars', 'Jupiter', 'Saturn']
+
+    Returns:
+        times, heights
+        times: a list of sequential timezone-naive datetime.datetimes (in UTC)
+        heights: a dict of lists of altitudes (radians), one per body name,
+            each the same as fill_in_heights would return
+
+    Example:
+    >>> cruz = ephem.Observer()
+    >>> cruz.lat, cruz.lon = '36.97', '-122.02'
+    >>> time1 = ephem.Date('2015-05-15 19:00')   # local noon
+    >>> ti, he = fill_in_heights_multi(time1, time1 + ephem.hour,
+    ...                                30 * ephem.minute, cruz,
+    ...                                ['Sun', 'Moon', 'Venus'], False)
+    >>> for name in ['Sun', 'Moon', 'Venus']:
+    ...     print('{:>5}'.format(name), np.round(np.degrees(he[name]), 2))
+      Sun [67.1  70.45 71.94]
+     Moon [57.33 54.14 50.09]
+    Venus [35.82 41.78 47.76]
+    """
     times = []
-    heights = []
+    heights = dict((name, []) for name in body_names)
+    bodies = [(getattr(ephem, name)(), heights[name]) for name in body_names]
     obs = copy_ephem_observer(observe)
     obs.date = start
-    body = eval('ephem.' + body_name + '(obs)')
-    
+
     while round(obs.date, 6) < round(stop, 6):
         times.append(obs.date.datetime())
-        body.compute(obs) # compute new body position for the new observer time
-        height_now = body.alt # altitude angle (in radians)
-        heights.append(height_now)
+        for body, body_heights in bodies:
+            body.compute(obs) # new body position for the new observer time
+            body_heights.append(body.alt) # altitude angle (in radians)
         obs.date += step # observer moves forward one time step
-        
+
     obs.date = stop  # observer moves to exact stopping time
     times.append(obs.date.datetime())
-    body.compute(obs)
-    height_now = body.alt
-    heights.append(height_now)
-                
+    for body, body_heights in bodies:
+        body.compute(obs)
+        body_heights.append(body.alt)
+
     if append_NaN:
         times.append(ephem.Date(obs.date + step/100).datetime())
-        heights.append(float('NaN'))
-    
-    assert(len(times) == len(heights))        
+        for body_heights in heights.values():
+            body_heights.append(float('NaN'))
+
+    assert(all(len(times) == len(h) for h in heights.values()))
     return times, heights
+
+
+def adaptive_heights(start, stop, step, observe, body_name,
+                     coarse_steps = 12, tolerance = 0.002):
+    """Like `fill_in_heights` (without the NaN), but sample a subset of the
+    regular `step` grid: every sample time is one `fill_in_heights` would
+    use, with the same altitude.
+
+    The grid is first sampled every `coarse_steps` steps. Each interval
+    between samples is then bisected, down to single steps, unless either:
+      - the body is provably below the horizon throughout the interval,
+        given both end altitudes and MAX_ALTITUDE_RATE (calendars clip
+        everything below the horizon), or
+      - both ends are above the horizon and the altitude at the midpoint is
+        within `tolerance` (radians) of the straight line between the ends.
+    Intervals containing a rise or set are always bisected down to single
+    steps, so rise and set times match the full-resolution curve.
+
+    Example:
+    >>> cruz = ephem.Observer()
+    >>> cruz.lat, cruz.lon = '36.97', '-122.02'
+    >>> day = ephem.Date('2015-05-15 07:00')   # local midnight
+    >>> step = 10 * ephem.minute
+    >>> ti, he = fill_in_heights(day, day + 1, step, cruz, 'Sun', False)
+    >>> ati, ahe = adaptive_heights(day, day + 1, step, cruz, 'Sun')
+    >>> len(ti), len(ati)
+    (145, 58)
+    >>> dense = dict(zip(map(round_datetime, ti), he))
+    >>> all(abs(dense[round_datetime(t)] - h) < 1e-6 for t, h in zip(ati, ahe))
+    True
+    """
+    start, stop = ephem.Date(start), ephem.Date(stop)
+    obs = copy_ephem_observer(observe)
+    body = getattr(ephem, body_name)()
+    # number of regular grid times before stop, exactly as fill_in_heights
+    # counts them; the stop time itself is an extra, final sample
+    n = int((stop - start) / step) + 2
+    while n > 0 and not round(start + (n - 1) * step, 6) < round(stop, 6):
+        n -= 1
+    heights = {}
+
+    def _height(i):
+        if i not in heights:
+            obs.date = stop if i == n else ephem.Date(start + i * step)
+            body.compute(obs)
+            heights[i] = body.alt
+        return heights[i]
+
+    nodes = list(range(0, n, max(1, int(coarse_steps)))) + [n]
+    pending = list(zip(nodes[:-1], nodes[1:]))
+    while pending:
+        i, j = pending.pop()
+        if j - i < 2:
+            continue
+        hi, hj = _height(i), _height(j)
+        span = (j - i) * step
+        if hi < 0 and hj < 0 and (hi + hj + MAX_ALTITUDE_RATE * span) < 0:
+            continue   # cannot rise above the horizon in between
+        m = (i + j) // 2
+        hm = _height(m)
+        if hi >= 0 and hj >= 0 and hm >= 0:
+            linear = hi + (hj - hi) * (m - i) / (j - i)
+            if abs(hm - linear) <= tolerance:
+                continue
+        pending.extend([(i, m), (m, j)])
+
+    times = []
+    heights_out = []
+    for i in sorted(heights):
+        date = stop if i == n else ephem.Date(start + i * step)
+        times.append(date.datetime())
+        heights_out.append(heights[i])
+    return times, heights_out
     
     
 def get_lunation_day(today, number_of_phase_ids=28):
@@ -216,6 +352,327 @@ def get_lunation_day(today, number_of_phase_ids=28):
     return first_approx
 
 
+def lunation_table(start, stop, margin = 60):
+    """Return the Moon's principal phases from the last new moon before
+    `start` through at least `margin` days after `stop` (ephem.Dates or
+    floats), as a dict of float arrays (ephem dates) with one element per
+    lunation: 'new' (the new moon starting it), and the 'first_quarter',
+    'full' and 'last_quarter' moons following it, as ephem.next_*_moon finds
+    them from that new moon. 'new' has one extra, final element: the end of
+    the last lunation.
+
+    Example:
+    >>> table = lunation_table(ephem.Date('2016-01-01'),
+    ...                        ephem.Date('2016-01-31'), margin = 0)
+    >>> for new, full in zip(table['new'], table['full']):
+    ...     print(ephem.Date(new), '...', ephem.Date(full))
+    2015/12/11 10:29:25 ... 2015/12/25 11:11:29
+    2016/1/10 01:30:32 ... 2016/1/24 01:45:44
+    """
+    phases = dict((key, []) for key in
+                  ('new', 'first_quarter', 'full', 'last_quarter'))
+    new = ephem.previous_new_moon(start)
+    while True:
+        phases['new'].append(float(new))
+        if new > stop + margin:
+            break
+        phases['first_quarter'].append(float(ephem.next_first_quarter_moon(new)))
+        phases['full'].append(float(ephem.next_full_moon(new)))
+        last_quarter = ephem.next_last_quarter_moon(new)
+        phases['last_quarter'].append(float(last_quarter))
+        new = ephem.next_new_moon(last_quarter)
+    return dict((key, np.array(value)) for key, value in phases.items())
+
+
+def lunation_days(dates, table, number_of_phase_ids = 28):
+    """Vectorized `get_lunation_day`: lunation day ID numbers (int array) for
+    an array of dates (floats, ephem dates), looked up in a `lunation_table`
+    that spans them. Same calibration to the quarter phases, and the same
+    result as get_lunation_day for each date.
+
+    Example:
+    >>> days = ephem.Date('2016-03-01') + np.arange(3) * 10.
+    >>> table = lunation_table(days[0], days[-1], margin = 0)
+    >>> lunation_days(days, table)
+    array([19,  2, 11])
+    >>> [get_lunation_day(day) for day in days]
+    [19, 2, 11]
+    """
+    dates = np.asarray(dates, dtype = float)
+    new = table['new']
+    i = np.searchsorted(new, dates, side = 'right') - 1
+    if np.any(i < 0) or np.any(i >= len(new) - 1):
+        raise ValueError('In lunation_days, dates are outside the table')
+    last_new, next_new = new[i], new[i + 1]
+    since_new = dates - last_new
+    num = number_of_phase_ids - 1
+    first_approx = np.round(since_new / (next_new - last_new) * num)
+    # the quarter phase checks of get_lunation_day, in order of precedence
+    checks = []
+    for key, fraction in (('first_quarter', num / 4), ('full', num / 2),
+                          ('last_quarter', num * 3 / 4)):
+        phase = table[key][i]
+        checks.append(((first_approx < np.ceil(fraction)) & (dates < phase),
+                       np.round(since_new / (phase - last_new) * fraction)))
+    result = np.select([c for c, _ in checks], [r for _, r in checks],
+                       first_approx)
+    return result.astype(int)
+
+
+# Mean apparent radii (degrees) of bodies whose rising and setting, like
+# ephem's next_rising/next_setting, is when the upper limb is on the horizon.
+MEAN_RADIUS = {'Sun': 16.0 / 60, 'Moon': 15.54 / 60}
+
+# ephem dates are days since 1899-12-31 12:00 UTC
+EPHEM_UNIX_EPOCH = 25567.5
+
+
+def local_maxima(times, values):
+    """Return the times and values of the local maxima of a sampled curve,
+    from the parabola through each sample higher than its neighbours and
+    those two neighbours. Samples need not be evenly spaced.
+
+    Returns:
+        peak_times (int64 array, in the units of `times`), peak_values
+
+    Example:
+    >>> t = np.array([0, 10, 20, 30, 40, 60])
+    >>> local_maxima(t, 5. - (t - 18.)**2 / 100.)
+    (array([18]), array([5.]))
+    """
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    with np.errstate(invalid='ignore'):
+        i = np.flatnonzero((values[1:-1] > values[:-2]) &
+                           (values[1:-1] >= values[2:])) + 1
+    a = (times[i - 1] - times[i]).astype(float)   # < 0
+    b = (times[i + 1] - times[i]).astype(float)   # > 0
+    d0 = values[i - 1] - values[i]
+    d2 = values[i + 1] - values[i]
+    # values[i] + c1 * x + c2 * x**2 through the three samples, x = t - t[i]
+    det = a * b * (b - a)
+    c1 = (d0 * b * b - d2 * a * a) / det
+    c2 = (d2 * a - d0 * b) / det
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.where(c2 < 0, -c1 / (2 * c2), 0.)
+    x = np.clip(x, a, b)
+    peaks = values[i] + c1 * x + c2 * x * x
+    return times[i] + np.round(x).astype(np.int64), peaks
+
+
+def make_observer(latitude, longitude):
+    """Return an ephem.Observer at sea level at the given latitude and
+    longitude (decimal degrees, as strings, i.e. '36.9577', '-122.0402')."""
+    observer = ephem.Observer()
+    observer.lat = ephem.degrees(latitude)
+    observer.long = ephem.degrees(longitude)
+    observer.elevation = 0
+    return observer
+
+
+def time_grid(start, stop, step):
+    """Return the regular sample times of `fill_in_heights` before `stop`
+    (ephem dates, as floats), accumulated exactly as it does; it samples
+    `stop` itself too."""
+    grid = []
+    date = float(start)
+    while round(date, 6) < round(stop, 6):
+        grid.append(date)
+        date += step
+    return grid
+
+
+def chunk_bounds(start, stop, step, count):
+    """Split the time grid of `fill_in_heights` from start to stop into at
+    most `count` consecutive chunks. Returns the chunk boundaries as floats
+    (ephem dates): the first is start, the last is stop, and the others are
+    grid times, accumulated exactly as fill_in_heights does. So the results
+    of fill_in_heights over consecutive chunks, without each chunk's final
+    sample (the next chunk's first), put together equal its result over the
+    whole range.
+
+    Example:
+    >>> bounds = chunk_bounds(ephem.Date('2016-01-01'), ephem.Date('2016-01-02'),
+    ...                       ephem.hour, 4)
+    >>> [round_datetime(ephem.Date(b).datetime()).hour for b in bounds]
+    [0, 6, 12, 18, 0]
+    """
+    grid = time_grid(start, stop, step)
+    count = max(1, min(int(count), len(grid)))
+    if not grid:
+        return [float(start), float(stop)]
+    return [grid[len(grid) * k // count] for k in range(count)] + [float(stop)]
+
+
+def _altitude_chunk(job):
+    """Worker for Astro: altitudes of bodies over one chunk from
+    `chunk_bounds`, without its final sample unless it is the last chunk.
+    Returns a dict of (times, heights) per body name."""
+    latitude, longitude, names, start, stop, step, adaptive, last = job
+    observer = make_observer(latitude, longitude)
+    if adaptive:  # sample times differ between bodies
+        result = dict((name, fill_in_heights(start, stop, step, observer,
+                                             name, append_NaN = False,
+                                             adaptive = True))
+                      for name in names)
+    else:
+        times, heights = fill_in_heights_multi(start, stop, step, observer,
+                                               names, append_NaN = False)
+        result = dict((name, (times, heights[name])) for name in names)
+    end = None if last else -1
+    # ephem.Angle won't unpickle: send floats
+    return dict((name, (times[:end], [float(h) for h in heights[:end]]))
+                for name, (times, heights) in result.items())
+
+
+def _moon_phase_chunk(job):
+    """Worker for Astro: Moon phase (fraction illuminated) at each of a list
+    of dates."""
+    latitude, longitude, dates = job
+    observer = make_observer(latitude, longitude)
+    moon = ephem.Moon()
+    illuminated = []
+    for date in dates:
+        observer.date = date
+        moon.compute(observer)
+        illuminated.append(moon.moon_phase)
+    return illuminated
+
+
+def snap_to_grid(coordinate, grid):
+    """Round a coordinate in decimal degrees (string or number) to the
+    nearest multiple of `grid` degrees, returned as a decimal degree string.
+
+    Example:
+    >>> snap_to_grid('36.9577', 0.1), snap_to_grid('-122.0402', 0.1)
+    ('37.000000', '-122.000000')
+    """
+    return '{:.6f}'.format(round(float(coordinate) / grid) * grid)
+
+
+def _pool_map(pool, processes):
+    """Return the number of chunks to split a year-long loop into, and a
+    map function running jobs on `pool` (or here, if pool is None)."""
+    if pool is None:
+        return 1, lambda func, jobs: [func(job) for job in jobs]
+    return 4 * (processes or multiprocessing.cpu_count()), pool.map
+
+
+def altitude_series(latitude, longitude, timezone, year, names,
+                    adaptive = False, pool = None, processes = 1,
+                    ephemeris = None):
+    """Return the year-long altitude series of several bodies, as Astro
+    computes them for its `altitudes` attribute, in one pass over the time
+    grid (see `fill_in_heights_multi`), split into chunks across `pool` if
+    one is given. Arguments are as for Astro, with `names` a list of body
+    names. Returns a dict of pandas Series, one per body name.
+    """
+    chunks, _map = _pool_map(pool, processes)
+    begin, end = utc_year_bounds(timezone, year)
+    step = 10 * ephem.minute #resolution of full timeseries of body heights
+
+    if ephemeris is not None:
+        dates = time_grid(begin, end, step) + [float(end)]
+        times = [ephem.Date(date).datetime() for date in dates]
+        series = {}
+        for name in names:
+            if isinstance(ephemeris, dict):
+                body = ephemeris[name]
+            else:
+                body = ChebyshevEphemeris.for_year(name, year, cache = True)
+            hei = pd.Series(topocentric_altitudes(body, latitude, longitude,
+                                                  dates), times)
+            hei.index = hei.index.tz_localize('UTC')
+            hei.index = hei.index.tz_convert(timezone)
+            series[name] = hei
+        return series
+
+    bounds = chunk_bounds(begin, end, step, chunks)
+    jobs = [(latitude, longitude, list(names), a, b, step, adaptive,
+             b == bounds[-1]) for a, b in zip(bounds[:-1], bounds[1:])]
+    alltimes = dict((name, []) for name in names)
+    allheights = dict((name, []) for name in names)
+    for result in _map(_altitude_chunk, jobs):
+        for name, (times, heights) in result.items():
+            alltimes[name].extend(times)
+            allheights[name].extend(heights)
+    series = {}
+    for name in names:
+        # convert to pandas timeseries and localize the time index
+        assert(len(allheights[name]) == len(alltimes[name]))
+        hei = pd.Series(allheights[name], alltimes[name])
+        hei.index = hei.index.tz_localize('UTC')
+        hei.index = hei.index.tz_convert(timezone)
+        series[name] = hei
+    return series
+
+
+def ephemeris_error(name, latitude, longitude, timezone, year,
+                    ephemeris = None):
+    """Return the largest difference (radians) over the year between the
+    altitudes of body `name` from a Chebyshev ephemeris (see
+    `Astro(..., ephemeris=True)`; by default one built for the year, not
+    cached) and those of `fill_in_heights`, at the 10-minute steps of
+    `altitude_series`. Arguments are as for Astro.
+
+    Example:
+    >>> for name in ['Sun', 'Moon']:
+    ...     error = ephemeris_error(name, '36.9577', '-122.0402',
+    ...                             'America/Los_Angeles', '2016')
+    ...     print(name, error < 1e-5)
+    Sun True
+    Moon True
+    """
+    if ephemeris is None:
+        ephemeris = ChebyshevEphemeris.for_year(name, year)
+    fitted = altitude_series(latitude, longitude, timezone, year, [name],
+                             ephemeris = {name: ephemeris})[name]
+    begin, end = utc_year_bounds(timezone, year)
+    _, heights = fill_in_heights(begin, end, 10 * ephem.minute,
+                                 make_observer(latitude, longitude), name,
+                                 append_NaN = False)
+    assert(len(heights) == len(fitted))
+    return float(np.max(np.abs(fitted.values - np.array(heights))))
+
+
+def build_astros(latitude, longitude, timezone, year, names = ('Sun', 'Moon'),
+                 processes = None, adaptive = False, cache = None,
+                 grid = 0.1, ephemeris = None):
+    """Return a list of Astro objects, one per body in `names` (i.e. 'Sun',
+    'Moon', and planets such as 'Venus' or 'Mars'). Their altitudes are
+    computed together in one pass over the time grid (see altitude_series),
+    on one shared pool of `processes` worker processes (None = one per CPU).
+    Other arguments are as for Astro. With processes = 1, everything is
+    computed in this process. With a cache, nothing is computed for bodies
+    found in it, unless another body is missing.
+    """
+    if cache is True:
+        cache = DiskCache('astro')
+    if cache is not None:   # compute where Astro will look in the cache
+        latitude = snap_to_grid(latitude, grid)
+        longitude = snap_to_grid(longitude, grid)
+
+    def _build(pool):
+        walked = {}
+
+        def _altitudes(name):
+            if not walked:
+                walked.update(altitude_series(latitude, longitude, timezone,
+                                              year, names, adaptive, pool,
+                                              processes, ephemeris))
+            return walked[name]
+
+        return [Astro(latitude, longitude, timezone, year, name,
+                      adaptive = adaptive, processes = processes, pool = pool,
+                      cache = cache, grid = grid, altitudes = _altitudes,
+                      ephemeris = ephemeris)
+                for name in names]
+
+    if processes == 1:
+        return _build(None)
+    with multiprocessing.Pool(processes) as pool:
+        return _build(pool)
+
 
 class Astro:
     """A class with year- and location-specific rise, set, and altitude for an
@@ -224,7 +681,9 @@ class Astro:
     sun, moon, or other astronomical body for a Sun * Moon * Tide calendar.
     """
     def __init__(self, latitude: str, longitude: str, timezone: str, year: str,
-                 name: str):
+                 name: str, adaptive: bool = False, processes: int = 1,
+                 pool = None, cache = None, grid: float = 0.1,
+                 altitudes = None, ephemeris = None):
         """Take the all necessary location/year/body name information and
         construct plot-ready astronomical body time series for calendar.
         Attributes are all set and ready for queries/plotting after __init__.
@@ -236,28 +695,124 @@ class Astro:
         year = the year desired for the calendar, as a string, i.e. '2016'
         name = the name of the astronomical body as a string, first letter
                capitalized, i.e. 'Sun' or 'Moon'
+
+        Optional:
+        adaptive = if True, sample altitudes adaptively (see adaptive_heights)
+                   instead of every 10 minutes: much faster, and the same
+                   curve above the horizon. altitudes is then irregular.
+        processes = number of worker processes to split the year-long
+                    computations across (None = one per CPU); the default, 1,
+                    computes everything in this process. Results are the same.
+        pool = a multiprocessing.Pool to use instead of starting one, e.g. to
+               share it between bodies (see build_astros)
+        cache = a cache.DiskCache, or True for the default DiskCache('astro').
+                Results are stored under the location rounded to `grid`
+                degrees (see snap_to_grid), time zone, year, body and
+                sampling, and computed for that rounded location, so nearby
+                stations share them. cache.stats() reports the hit rate.
+        grid = cache only; size of the location grid in degrees, default 0.1
+               (about 10 km, a few seconds of rise/set time)
+        altitudes = precomputed `altitudes` for this body and location (see
+                    altitude_series), or a function of the body name that
+                    returns them, called only if they need computing
+        ephemeris = True to compute altitudes with numpy from a Chebyshev
+                    ephemeris of the body for the year (see ephemeris.py),
+                    built once and kept in DiskCache('ephemeris'), or a dict
+                    of ephemeris.ChebyshevEphemeris by body name. Altitudes
+                    are within 1e-5 radians of PyEphem's (see
+                    ephemeris_error), at 10-minute steps (adaptive is
+                    ignored), and about 4 times faster.
         """
         self.latitude = latitude
         self.longitude = longitude
         self.timezone = timezone
         self.year = year
         self.name = name
-        
-        observer = ephem.Observer()
-        observer.lat = ephem.degrees(latitude)
-        observer.long = ephem.degrees(longitude)
-        observer.elevation = 0
+
+        if cache is True:
+            cache = DiskCache('astro')
+        if cache is not None:
+            latitude = snap_to_grid(latitude, grid)
+            longitude = snap_to_grid(longitude, grid)
+        # where everything is computed (the grid point, if cached), for
+        # rise_set_table to refine at the same place
+        self._observer_location = (latitude, longitude)
+        if cache is not None:
+            key = content_key('Astro', latitude, longitude, timezone,
+                              str(year), name, adaptive, ephem.__version__,
+                              *(['chebyshev'] if ephemeris else []))
+            stored = cache.get_arrays(key)
+            if stored is not None:
+                self._set_from_arrays(stored)
+                return
+
+        if callable(altitudes):
+            altitudes = altitudes(name)
+        if pool is None and processes != 1:
+            with multiprocessing.Pool(processes) as pool:
+                self._compute(latitude, longitude, adaptive, pool, processes,
+                              altitudes, ephemeris)
+        else:
+            self._compute(latitude, longitude, adaptive, pool, processes,
+                          altitudes, ephemeris)
+
+        if cache is not None:
+            cache.put_arrays(key, **self._to_arrays())
+
+    def _to_arrays(self):
+        """Dict of numpy arrays holding all computed attributes; inverse of
+        `_set_from_arrays`."""
+        def _ns(series):
+            return series.index.tz_convert('UTC').asi8
+        arrays = {'times': _ns(self.altitudes),
+                  'altitudes': self.altitudes.values}
+        if self.name == 'Sun':
+            arrays['event_times'] = _ns(self.events)
+            arrays['event_names'] = np.array(self.events.values, dtype = str)
+        if self.name == 'Moon':
+            arrays['illuminated'] = self.percent_illuminated.values
+            arrays['phase_day_num'] = self.phase_day_num.values
+            arrays['half_phase_times'] = _ns(self.half_phases)
+            arrays['half_phase_names'] = np.array(self.half_phases.values,
+                                                  dtype = str)
+        return arrays
+
+    def _set_from_arrays(self, stored):
+        """Set all computed attributes from `_to_arrays` output."""
+        def _series(values, times):
+            index = pd.DatetimeIndex(times.astype('datetime64[ns]'))
+            return pd.Series(values, index.tz_localize('UTC').tz_convert(
+                self.timezone))
+        self.altitudes = _series(stored['altitudes'], stored['times'])
+        if self.name == 'Sun':
+            self.events = _series(stored['event_names'].astype(object),
+                                  stored['event_times'])
+        if self.name == 'Moon':
+            daily_times = pd.date_range(self.year + '-01-01',
+                                        self.year + '-12-31',
+                                        tz = self.timezone)
+            self.percent_illuminated = pd.Series(stored['illuminated'],
+                                                 daily_times)
+            self.phase_day_num = pd.Series(stored['phase_day_num'],
+                                           daily_times)
+            self.half_phases = _series(
+                stored['half_phase_names'].astype(object),
+                stored['half_phase_times'])
+
+    def _compute(self, latitude, longitude, adaptive, pool, processes,
+                 altitudes = None, ephemeris = None):
+        """Set all attributes, computed at the given location (except
+        altitudes, if given). With a pool, the year-long loops are split
+        into 4 jobs per process."""
+        timezone, year, name = self.timezone, self.year, self.name
+        chunks, _map = _pool_map(pool, processes)
         begin, end = utc_year_bounds(timezone, year)
-        step = 10 * ephem.minute #resolution of full timeseries of body heights
-        
-        alltimes, allheights = fill_in_heights(begin, end, step,
-                                             observer, name, append_NaN=False)        
-        '''Convert to pandas timeseries and localize the time index.'''
-        assert(len(allheights) == len(alltimes))
-        hei = pd.Series(allheights, alltimes)
-        hei.index = hei.index.tz_localize('UTC')
-        hei.index = hei.index.tz_convert(timezone)
-        self.altitudes = hei
+
+        if altitudes is None:
+            altitudes = altitude_series(latitude, longitude, timezone, year,
+                                        [name], adaptive, pool, processes,
+                                        ephemeris)[name]
+        self.altitudes = altitudes
 
 # ----------------- Special attributes for Sun and Moon ----------------
 
@@ -278,41 +833,47 @@ class Astro:
 
         '''Daily phase (% illuminated, 28-day icon ID) for Moon'''
         if name == 'Moon':
-            moon = ephem.Moon()
+            moon_days = []
+            moon_day = begin + 22 * ephem.hour   # 10 pm local time Jan 1
+            while moon_day < end:
+                moon_days.append(moon_day)
+                moon_day += 1
+            size = -(-len(moon_days) // chunks)
+            jobs = [(latitude, longitude, moon_days[i:i + size])
+                    for i in range(0, len(moon_days), size)]
             illuminated = []
-            observer.date = begin + 22 * ephem.hour  # 10 pm local time Jan 1
-            moon.compute(observer)
-            while observer.date < end:
-                illuminated.append(moon.moon_phase)
-                observer.date += 1
-                moon.compute(observer)
+            for chunk_illuminated in _map(_moon_phase_chunk, jobs):
+                illuminated.extend(chunk_illuminated)
             daily_times = pd.date_range(year + '-01-01', year + '-12-31', 
                                       tz = timezone)
             assert(len(illuminated) == len(daily_times))
             self.percent_illuminated = pd.Series(illuminated, daily_times)
-            
-            cycle_days = []            
-            moon_day = begin + 22 * ephem.hour   # 10 pm local time Jan 1
-            while moon_day < end:
-                    cycle_days.append(get_lunation_day(moon_day))
-                    moon_day += 1
+
+            # one table of the year's phases replaces per-day phase searches
+            table = lunation_table(begin, end)
+            cycle_days = lunation_days(moon_days, table)
             assert(len(cycle_days) == len(daily_times))
             self.phase_day_num = pd.Series(cycle_days, daily_times)
             
+            def _next(key, date):
+                phases = table[key]
+                return ephem.Date(phases[np.searchsorted(phases, date,
+                                                         side = 'right')])
+
             exact_names = []
             exact_times = []
             nowdate = begin
             if cycle_days[0] < 14:
-                next_full = ephem.next_full_moon(nowdate)
+                next_full = _next('full', nowdate)
                 exact_times.append(next_full.datetime())
                 exact_names.append('full')
                 nowdate = next_full
             while nowdate < end:
-                next_new = ephem.next_new_moon(nowdate)
+                next_new = _next('new', nowdate)
                 exact_times.append(next_new.datetime())
                 exact_names.append('new')
                 nowdate = next_new
-                next_full = ephem.next_full_moon(nowdate)
+                next_full = _next('full', nowdate)
                 exact_times.append(next_full.datetime())
                 exact_names.append('full')
                 nowdate = next_full
@@ -321,7 +882,108 @@ class Astro:
             half_phases.index = half_phases.index.tz_convert(timezone)
             self.half_phases = half_phases
 
+    def intervals_above(self, altitude=0., start=None, stop=None):
+        """Time intervals during which the body is above `altitude` (degrees,
+        default 0 = the horizon), from the sampled `altitudes` series.
+        Optional `start`/`stop` (anything pandas.Timestamp accepts; naive
+        times are local time) limit the search. Returns a pandas DataFrame
+        with tz-aware 'start' and 'stop' columns, one row per interval.
+        """
+        hei = self.altitudes
+        if start is not None or stop is not None:
+            hei = hei[self._local(start):self._local(stop)]
+        times = hei.index.values.astype('datetime64[ns]').astype(np.int64)
+        starts, stops = intervals_above(times, hei.values,
+                                        np.radians(altitude))
+        def _to_local(ns):
+            index = pd.DatetimeIndex(ns.astype('datetime64[ns]'))
+            return index.tz_localize('UTC').tz_convert(self.timezone)
+        return pd.DataFrame({'start': _to_local(starts),
+                             'stop': _to_local(stops)},
+                            columns = ['start', 'stop'])
+
+    def rise_set_table(self, refine = False):
+        """Every rising, transit and setting of the body in `altitudes`, as
+        a pandas DataFrame sorted by time, with columns
+            time: tz-aware local time of the event
+            event: 'rise', 'transit' or 'set'
+            altitude: degrees; the highest altitude for transits, else the
+                horizon level used (minus the body's mean apparent radius)
+        Rising and setting follow ephem's next_rising/next_setting: the
+        upper limb of the body on the horizon, with atmospheric refraction
+        (planets are taken as points, unless refined).
+
+        Without refinement, events come from the altitude samples alone
+        (no ephemeris calls): crossings by linear interpolation, transits at
+        the peak of a parabola through the three highest samples. With
+        10-minute samples, rise and set times are within about 20 seconds of
+        ephem's, and transits within 20 seconds, except for the Moon: its
+        highest altitude is up to 3 minutes from its meridian crossing.
+
+        refine (bool): if True, refine each event with a few ephem
+            computations (secant method) to within a second: rise and set to
+            the body's actual radius, transits to the meridian crossing, as
+            ephem's next_transit. Like `altitudes`, they are for the cache
+            grid point if the results are cached (see snap_to_grid).
+        """
+        hei = self.altitudes
+        times = hei.index.tz_convert('UTC').asi8
+        radius = np.radians(MEAN_RADIUS.get(self.name, 0.))
+        rises, sets = level_crossings(times, hei.values, -radius)
+        transits, peaks = local_maxima(times, hei.values)
+
+        if refine:
+            observer = make_observer(*self._observer_location)
+            body = getattr(ephem, self.name)()
+
+            def _at(date):
+                observer.date = date
+                body.compute(observer)
+                return body
+
+            def _horizon(date):
+                body = _at(date)
+                return body.alt + body.radius
+
+            def _meridian(date):
+                return (_at(date).ha + np.pi) % (2 * np.pi) - np.pi
+
+            def _refined(ns, func):
+                dates = [_secant(func, date) for date in
+                         ns / 86400e9 + EPHEM_UNIX_EPOCH]
+                return np.round((np.array(dates, dtype=float) -
+                                 EPHEM_UNIX_EPOCH) * 86400e9).astype(np.int64)
+
+            rises = _refined(rises, _horizon)
+            sets = _refined(sets, _horizon)
+            transits = _refined(transits, _meridian)
+            peaks = np.array([float(_at(date).alt) for date in
+                              transits / 86400e9 + EPHEM_UNIX_EPOCH])
+
+        table = pd.DataFrame({
+            'time': np.concatenate([rises, transits, sets]),
+            'event': ['rise'] * len(rises) + ['transit'] * len(transits) +
+                     ['set'] * len(sets),
+            'altitude': np.degrees(np.concatenate([
+                np.full(len(rises), 0. - radius), peaks,
+                np.full(len(sets), 0. - radius)]))},
+            columns = ['time', 'event', 'altitude'])
+        table = table.sort_values('time', kind = 'mergesort')
+        table.index = np.arange(len(table))
+        table['time'] = pd.DatetimeIndex(table['time'].values.astype(
+            'datetime64[ns]')).tz_localize('UTC').tz_convert(self.timezone)
+        return table
+
+    def _local(self, when):
+        """pandas.Timestamp in the local time zone, or None for None."""
+        if when is None:
+            return None
+        when = pd.Timestamp(when)
+        if when.tzinfo is None:
+            return when.tz_localize(self.timezone)
+        return when.tz_convert(self.timezone)
+
 
 if __name__ == "__main__":
     import doctest
-    doctest.testmod()
\ No newline at end of file
+    doctest.testmod()
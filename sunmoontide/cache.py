@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides DiskCache, a small content-addressed cache on disk for
+numpy arrays and raw bytes, with a size cap and least-recently-used eviction.
+Tides, Astro and the calendar page renderer use it to skip repeated work
+across runs.
+"""
+
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+# Format version of cached entries. Bump it to invalidate every cache entry
+# when the layout of cached arrays changes.
+CACHE_VERSION = 2
+
+# .bin entries end with the SHA-256 digest of their bytes
+BYTES_DIGEST = hashlib.sha256().digest_size
+
+
+def default_cache_dir():
+    """Return the root directory for sunmoontide caches: the SUNMOONTIDE_CACHE
+    environment variable if set, else ~/.cache/sunmoontide."""
+    root = os.environ.get('SUNMOONTIDE_CACHE')
+    if not root:
+        root = os.path.join(os.path.expanduser('~'), '.cache', 'sunmoontide')
+    return root
+
+
+def content_key(*parts):
+    """Return a hex SHA-1 digest identifying all `parts`, in order. Parts may
+    be bytes, strings, numbers, None, numpy arrays, or lists/tuples of these.
+
+    Example:
+    >>> content_key('tides', 100, None) == content_key('tides', 100, None)
+    True
+    >>> content_key('tides', 100) == content_key('tides', '100')
+    False
+    """
+    digest = hashlib.sha1()
+
+    def _feed(part):
+        if isinstance(part, (list, tuple)):
+            digest.update(b'[')
+            for p in part:
+                _feed(p)
+            digest.update(b']')
+            return
+        if isinstance(part, np.ndarray):
+            data = np.ascontiguousarray(part)
+            header = 'ndarray:{}:{}'.format(data.dtype.str, data.shape)
+            data = data.tobytes()
+        elif isinstance(part, bytes):
+            header, data = 'bytes', part
+        else:
+            header, data = type(part).__name__, repr(part).encode('utf-8')
+        digest.update('{}:{}:'.format(header, len(data)).encode('utf-8'))
+        digest.update(data)
+
+    _feed(CACHE_VERSION)
+    for part in parts:
+        _feed(part)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """A directory of cache entries, each named by a content key (see
+    `content_key`). Arrays are stored as uncompressed .npz files, raw bytes
+    as .bin files. Entries that cannot be read back intact are removed and
+    count as misses. Reading an entry marks it as recently used; when the
+    total size exceeds `max_bytes`, least recently used entries are removed.
+
+    Arguments:
+        name (str): subdirectory of `directory` for this cache, e.g. 'tides'
+    Optional:
+        directory (str): root directory; default `default_cache_dir()`
+        max_bytes (int): size cap of this cache, default 512 MB
+
+    Attributes hits and misses count lookups since creation; see `stats`.
+    """
+    def __init__(self, name, directory=None, max_bytes=512 * 2**20):
+        self.directory = os.path.join(directory or default_cache_dir(), name)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, key + extension)
+
+    def _found(self, path):
+        """Count a lookup, and mark the entry as recently used if present."""
+        if os.path.isfile(path):
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def get_arrays(self, key):
+        """Return the dict of arrays stored under `key`, or None."""
+        path = self._path(key, '.npz')
+        if not self._found(path):
+            return None
+        try:
+            with np.load(path) as stored:
+                return dict((k, stored[k]) for k in stored.files)
+        except Exception:
+            self._discard(path)   # unreadable entry counts as a miss
+            self.hits -= 1
+            self.misses += 1
+            return None
+
+    def put_arrays(self, key, **arrays):
+        """Store numpy arrays (keyword arguments) under `key`. Only plain
+        numeric, boolean and unicode arrays are stored; nothing is pickled."""
+        def _write(f):
+            np.savez(f, **arrays)
+        self._write(self._path(key, '.npz'), _write)
+
+    def get_bytes(self, key):
+        """Return the bytes stored under `key`, or None."""
+        path = self._path(key, '.bin')
+        if not self._found(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                stored = f.read()
+            data, digest = stored[:-BYTES_DIGEST], stored[-BYTES_DIGEST:]
+            if hashlib.sha256(data).digest() != digest:
+                raise ValueError('truncated or corrupt entry')
+            return data
+        except Exception:
+            self._discard(path)   # unreadable entry counts as a miss
+            self.hits -= 1
+            self.misses += 1
+            return None
+
+    def put_bytes(self, key, data):
+        """Store `data` (bytes) under `key`, followed by its SHA-256 digest,
+        which get_bytes checks."""
+        def _write(f):
+            f.write(data)
+            f.write(hashlib.sha256(data).digest())
+        self._write(self._path(key, '.bin'), _write)
+
+    def _write(self, path, writer):
+        """Write an entry atomically (temp file, then rename), then evict."""
+        handle, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                writer(f)
+            os.replace(temp_path, path)
+        except Exception:
+            self._discard(temp_path)
+            raise
+        self.evict()
+
+    def _discard(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in
+        max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(('.npz', '.bin')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._discard(path)
+            total -= size
+
+    def clear(self):
+        """Remove every entry of this cache."""
+        for name in os.listdir(self.directory):
+            if name.endswith(('.npz', '.bin', '.tmp')):
+                self._discard(os.path.join(self.directory, name))
+
+    def stats(self):
+        """Return a dict with hits, misses and hit_rate (None before any
+        lookup) since this DiskCache was created."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': (self.hits / lookups) if lookups else None}
@@ -1,26 +1,54 @@
 # -*- coding: utf-8 -*-
 """
 Module for drawing most of a Sun * Moon * Tide calendar using matplotlib. Main
-function is generate_annual_calendar. Various helper functions may also be
-useful in other applications.
+function is generate_annual_calendar. render_pages draws pages as separate
+PNG, WebP or SVG files instead. Both can keep each page in a cache under a key
+of its inputs (see page_key) and draw only the pages that changed. Various
+helper functions may also be useful in other applications.
 """
 import matplotlib
-matplotlib.use('PDF')
+matplotlib.use('Agg')  # raster pages; PDF and SVG pages switch renderer
 from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib import font_manager
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
 plt.ioff()
 
 import calendar
+import datetime
 import numpy as np
 import pandas as pd
-from PIL import Image
-import pkgutil
 from PyPDF2 import PdfFileMerger, PdfFileReader
+from functools import lru_cache
 from io import BytesIO
+import multiprocessing
 import os
+import pkgutil
+import weakref
 
+from cache import content_key
 import cal_pages
+from cal_template import (month_template, font, add_moon_icons,
+                          MOON_PHASE_GLYPHS)
+from decimate import simplify
+
+# Output profiles: the largest error (in points, 1/72 inch) allowed when the
+# sun, moon and tide curves are simplified before drawing (see decimate.py).
+# 'print' is below the dot size of a 300 dpi printer, 'screen' below a pixel
+# at 100% zoom; 'full' draws every sample.
+DECIMATION = {'print': 0.1, 'screen': 0.5, 'full': None}
+
+# Files whose contents decide how the matplotlib pages and the WeasyPrint
+# About and Technical Details pages look, for page_key; and the font families
+# of all pages, whose files as matplotlib finds them also count
+PAGE_SOURCES = {
+    'matplotlib': ('cal_draw.py', 'cal_template.py', 'decimate.py',
+                   'graphics/logo.png'),
+    'about': ('cal_pages.py', 'infopages/about.html', 'graphics/legend.svg',
+              'graphics/logo.png'),
+    'tech': ('cal_pages.py', 'infopages/tech.html'),
+}
+PAGE_FONTS = ['Alegreya', 'Alegreya SC', 'FoglihtenNo01', 'moon phases']
 
 
 def days_in_month(year_month_string):
@@ -67,33 +95,319 @@ def date_after(year_month_day_string):
 
 
 
-def generate_annual_calendar(tide_obj, sun_obj, moon_obj, file_name):
+class DaySliceIndex:
+    """Positions of the local midnights of each day of a year in a time
+    series such as Tides.all_tides or Astro.altitudes, found once with
+    searchsorted, so that a day's samples are a pair of integer offsets into
+    plain numpy arrays rather than pandas label lookups.
+
+    Attributes:
+        times: the series' times as matplotlib date numbers
+        values: the series' values
+        midnights: matplotlib date numbers of the local midnights from Jan 1
+            of the year to Jan 1 of the next
+        bounds: position in the series of the first sample at or after each
+            of those midnights
+
+    Example:
+    >>> times = pd.date_range('2015-01-01', '2016-01-03', freq = '6H',
+    ...                       tz = 'US/Pacific')
+    >>> days = DaySliceIndex(pd.Series(np.arange(len(times)), times), 2015,
+    ...                      pad = 2)
+    >>> days.padded('2015-01-02')[1]
+    array([ 2,  3,  4,  5,  6,  7,  8,  9, 10])
+    >>> days.padded('2015-01-01')[1]
+    array([0, 1, 2, 3, 4, 5, 6])
+    >>> days.padded('2015-12-31')[1]
+    array([1454, 1455, 1456, 1457, 1458, 1459, 1460, 1461, 1462])
+    """
+    def __init__(self, series, year, pad = 10):
+        """`pad` is the number of samples from each neighbouring day
+        included in `padded`, for smooth curves at midnight."""
+        self.year = int(year)
+        self.pad = pad
+        index = series.index.tz_convert('UTC').tz_localize(None)
+        self.times = matplotlib.dates.date2num(index.values)
+        self.values = series.values
+        first = datetime.date(self.year, 1, 1)
+        days = (datetime.date(self.year + 1, 1, 1) - first).days
+        midnights = pd.date_range(first, periods = days + 1, freq = 'D',
+                                  tz = series.index.tz)
+        self.midnights = matplotlib.dates.date2num(
+            midnights.tz_convert('UTC').tz_localize(None).values)
+        self.bounds = np.searchsorted(self.times, self.midnights)
+        self._first = first.toordinal()
+
+    def day_number(self, date):
+        """Day of the year, counted from 0, of a '%Y-%m-%d' date string."""
+        return (datetime.date(*map(int, date.split('-'))).toordinal()
+                - self._first)
+
+    def limits(self, date):
+        """Matplotlib date numbers of the midnights starting and ending a
+        '%Y-%m-%d' date string."""
+        day = self.day_number(date)
+        return self.midnights[day], self.midnights[day + 1]
+
+    def padded(self, date):
+        """Times and values of the samples of a '%Y-%m-%d' date string, with
+        `pad` samples of the day before and `pad` + 1 of the day after, or as
+        many as the series has (e.g. on Jan 1 of its first year)."""
+        day = self.day_number(date)
+        start = max(self.bounds[day] - self.pad, 0)
+        stop = min(self.bounds[day + 1] + self.pad + 1, len(self.times))
+        return self.times[start:stop], self.values[start:stop]
+
+
+# DaySliceIndex of each series, by id, while the series exists
+_day_slice_indexes = {}
+
+
+def day_slice_index(series, year):
+    """The DaySliceIndex of a series for a year, built on first use."""
+    key = (id(series), int(year))
+    if key not in _day_slice_indexes:
+        _day_slice_indexes[key] = DaySliceIndex(series, year)
+        weakref.finalize(series, _day_slice_indexes.pop, key, None)
+    return _day_slice_indexes[key]
+
+
+def _fill_under(ax, times, values, ylim, tolerance, **kwargs):
+    '''Fill the area between a curve and zero in `ax`, whose y limits will
+    be ylim, simplifying the curve to within `tolerance` points first (see
+    decimate.simplify). `times` are matplotlib date numbers, `values` an
+    array.
+    '''
+    height = ax.get_position().height * ax.figure.get_figheight() * 72
+    x, y = simplify(times, np.asarray(values, dtype = float), tolerance, ylim,
+                    height)
+    return ax.fill_between(x, y, np.zeros(len(x)), **kwargs)
+
+
+# Tides and Astro objects for page workers, set once per worker process by
+# _init_page_worker instead of being sent along with every page
+_page_data = {}
+
+
+def _init_page_worker(tide_obj, sun_obj, moon_obj, profile):
+    _page_data['objects'] = (tide_obj, sun_obj, moon_obj)
+    _page_data['profile'] = profile
+
+
+def calendar_pages(year):
+    """Names of the matplotlib pages of a calendar, in order: 'cover',
+    'yearview', then the months as strings such as '2015-07'."""
+    return ['cover', 'yearview'] + list(months_in_year(str(year)))
+
+
+def _page_bytes(page, tide_obj, sun_obj, moon_obj, profile, format = 'pdf',
+                dpi = None):
+    """Draw one calendar page (see calendar_pages) and return it as the bytes
+    of a file in `format`, e.g. 'pdf', 'png' or 'svg', at `dpi` dots per inch
+    (None for savefig.dpi of the matplotlibrc)."""
+    if page == 'cover':
+        fig = cover(tide_obj)
+    elif page == 'yearview':
+        fig = yearview(tide_obj, sun_obj, moon_obj, profile)
+    else:
+        fig = month_page(page, tide_obj, sun_obj, moon_obj, profile)
+    page_file = BytesIO()
+    fig.savefig(page_file, format = format, dpi = dpi)
+    plt.close(fig)
+    return page_file.getvalue()
+
+
+def _render_page(job):
+    """Worker for generate_annual_calendar and render_pages: job is a page
+    name, format and dpi for _page_bytes."""
+    page, format, dpi = job
+    tide_obj, sun_obj, moon_obj = _page_data['objects']
+    return _page_bytes(page, tide_obj, sun_obj, moon_obj,
+                       _page_data['profile'], format, dpi)
+
+
+@lru_cache(maxsize = None)
+def code_version(kind):
+    """Content key of everything besides the data that pages of a `kind` of
+    PAGE_SOURCES depend on: those files, the font files matplotlib finds for
+    PAGE_FONTS, and the version of matplotlib and the matplotlibrc in use, or
+    of WeasyPrint. Computed once per process."""
+    parts = [pkgutil.get_data('cal_draw', name) for name in PAGE_SOURCES[kind]]
+    for family in PAGE_FONTS:
+        with open(font_manager.findfont(font(family, 12)), 'rb') as f:
+            parts.append(f.read())
+    if kind == 'matplotlib':
+        parts.append(matplotlib.__version__)
+        with open(matplotlib.matplotlib_fname(), 'rb') as f:
+            parts.append(f.read())
+    else:
+        parts.append(getattr(cal_pages.weasyprint, '__version__', None))
+    return content_key('code', kind, parts)
+
+
+def _series_key(series):
+    """The times (with time zone) and values of a pandas Series, for
+    content_key."""
+    values = series.values
+    if values.dtype == object:
+        values = values.astype(str)
+    return [str(series.index.tz), series.index.asi8, values]
+
+
+def page_key(page, tide_obj, sun_obj, moon_obj, profile, format = 'pdf',
+             dpi = None):
+    """Content key of a calendar page (see calendar_pages) drawn by
+    _page_bytes, or of the WeasyPrint page 'about' or 'tech' (sun_obj,
+    moon_obj, profile, format and dpi unused): the station fields and slice
+    of data the page shows, the profile, format and dpi and the code_version.
+    Pages of two runs with the same key are the same.
+    """
+    station = [tide_obj.station_name, tide_obj.state, str(tide_obj.year)]
+    if page == 'about':
+        return content_key('about', station, code_version('about'))
+    if page == 'tech':
+        fields = [getattr(tide_obj, name, None) for name in [
+            'station_id', 'station_type', 'timezone', 'ref_station_id',
+            'ref_station_name', 'height_offset_high', 'height_offset_low',
+            'height_addition_high', 'height_addition_low',
+            'time_offset_high', 'time_offset_low']]
+        return content_key('tech', station, fields, code_version('tech'))
+    if page == 'cover':
+        data = []
+    elif page == 'yearview':
+        data = [_series_key(sun_obj.altitudes), _series_key(moon_obj.altitudes),
+                _series_key(tide_obj.all_tides),
+                _series_key(moon_obj.half_phases), _series_key(sun_obj.events),
+                tide_obj.annual_min, tide_obj.annual_max]
+    else:
+        # the month's days, and the neighbouring days its curves extend into
+        days = list(days_in_month(page))
+        first, last = date_before(days[0]), date_after(days[-1])
+        data = [_series_key(series[first:last]) for series in [
+                    sun_obj.altitudes, moon_obj.altitudes, tide_obj.all_tides]]
+        data += [_series_key(moon_obj.phase_day_num[page]),
+                 _series_key(sun_obj.events[page:page]),
+                 tide_obj.annual_min, tide_obj.annual_max]
+    return content_key('page', page, station, data, profile, format, dpi,
+                       code_version('matplotlib'))
+
+
+def _drawn_pages(tide_obj, sun_obj, moon_obj, pages, format, dpi, processes,
+                 profile, cache):
+    """Yield the bytes of each of `pages` in order, as _page_bytes makes
+    them. Pages found in `cache` (a cache.DiskCache, or None) under their
+    page_key are not drawn again; the others are drawn here, or by
+    `processes` worker processes if more than one is missing, and stored."""
+    if cache is None:
+        keys = found = [None] * len(pages)
+    else:
+        keys = [page_key(page, tide_obj, sun_obj, moon_obj, profile, format,
+                         dpi) for page in pages]
+        found = [cache.get_bytes(key) for key in keys]
+    missing = [page for page, page_bytes in zip(pages, found)
+               if page_bytes is None]
+    pool = None
+    if processes != 1 and len(missing) > 1:
+        pool = multiprocessing.Pool(processes, _init_page_worker,
+                                    (tide_obj, sun_obj, moon_obj, profile))
+        drawn = pool.imap(_render_page,
+                          [(page, format, dpi) for page in missing])
+    else:
+        drawn = (_page_bytes(page, tide_obj, sun_obj, moon_obj, profile,
+                             format, dpi) for page in missing)
+    try:
+        for key, page_bytes in zip(keys, found):
+            if page_bytes is None:
+                page_bytes = next(drawn)
+                if cache is not None:
+                    cache.put_bytes(key, page_bytes)
+            yield page_bytes
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def _matter_pdfs(tide_obj, cache):
+    """The About page and the Technical Details section as PDF bytes, from
+    `cache` (a cache.DiskCache, or None) if there, else made by cal_pages
+    with WeasyPrint and stored."""
+    place = '{}, {}'.format(tide_obj.station_name, tide_obj.state)
+    matter = []
+    for page, make, argument in [('about', cal_pages.about, place),
+                                 ('tech', cal_pages.tech, tide_obj)]:
+        key = page_bytes = None
+        if cache is not None:
+            key = page_key(page, tide_obj, None, None, None)
+            page_bytes = cache.get_bytes(key)
+        if page_bytes is None:
+            temp_pdf = make(argument)
+            with open(temp_pdf, 'rb') as f:
+                page_bytes = f.read()
+            os.remove(temp_pdf)
+            if cache is not None:
+                cache.put_bytes(key, page_bytes)
+        matter.append(page_bytes)
+    return matter
+
+
+def generate_annual_calendar(tide_obj, sun_obj, moon_obj, file_name,
+                             processes = 1, profile = 'print', cache = None):
     '''Take tide, sun, and moon objects and generate a PDF file named
     `file_name`, which is a complete annual Sun * Moon * Tide calendar. File is
     saved to current working directory. Verbose output since this is a slow
     function.
-    
+
     Args:
     tide_obj: tides.Tides object
     sun_obj: astro.Astro object for 'Sun'
     moon_obj: astro.Astro object for 'Moon'
     file_name: string. ".pdf" will NOT be appended to the file_name so the .pdf
                 extension ought to be included in file_name.
+    processes: int, number of worker processes drawing the cover, overview
+                and month pages in parallel (None = one per CPU). Each worker
+                receives the tide, sun and moon objects once, draws whole
+                pages into in-memory PDFs, and the pages are merged in order.
+                With 1 (the default), pages are drawn here one after another
+                into a single PDF. Merged pages each embed their own copy of
+                the fonts, so the calendar is a few percent larger (also
+                with a cache).
+    profile: string, 'print' (the default), 'screen' or 'full': how finely
+                the sun, moon and tide curves are drawn (see DECIMATION).
+                'screen' makes a smaller file for viewing on screen.
+    cache: a cache.DiskCache for the PDF of each page, e.g.
+                DiskCache('pages'), or None (the default). Pages whose inputs
+                (see page_key) have not changed since they were stored, such
+                as all the month pages when only the front matter changed,
+                are taken from the cache instead of being drawn again.
     '''
-    with PdfPages('temp.pdf') as pdf_out:
-        coverfig = cover(tide_obj)
-        coverfig.savefig(pdf_out, format='pdf')
-        print('Calendar cover saved.')
-        yearviewfig = yearview(tide_obj, sun_obj, moon_obj)
-        print('{} Overview created, now saving...'.format(tide_obj.year))
-        yearviewfig.savefig(pdf_out, format='pdf')
-        print('{} Overview saved.'.format(tide_obj.year))
-
-        for month in months_in_year(tide_obj.year):
-            monthfig = month_page(month, tide_obj, sun_obj, moon_obj)
-            print('{} figure created, now saving...'.format(month))
-            monthfig.savefig(pdf_out, format='pdf')
-            print('Saved {}'.format(month))
+    if profile not in DECIMATION:
+        raise ValueError('In generate_annual_calendar, profile must be one \
+of {}, not {}'.format(sorted(DECIMATION), profile))
+    pages = calendar_pages(tide_obj.year)
+    if processes == 1 and cache is None:
+        page_pdfs = None
+        with PdfPages('temp.pdf') as pdf_out:
+            coverfig = cover(tide_obj)
+            coverfig.savefig(pdf_out, format='pdf')
+            print('Calendar cover saved.')
+            yearviewfig = yearview(tide_obj, sun_obj, moon_obj, profile)
+            print('{} Overview created, now saving...'.format(tide_obj.year))
+            yearviewfig.savefig(pdf_out, format='pdf')
+            print('{} Overview saved.'.format(tide_obj.year))
+
+            for month in pages[2:]:
+                monthfig = month_page(month, tide_obj, sun_obj, moon_obj,
+                                      profile)
+                print('{} figure created, now saving...'.format(month))
+                monthfig.savefig(pdf_out, format='pdf')
+                print('Saved {}'.format(month))
+    else:
+        page_pdfs = []
+        for page, page_pdf in zip(pages, _drawn_pages(
+                tide_obj, sun_obj, moon_obj, pages, 'pdf', None, processes,
+                profile, cache)):
+            page_pdfs.append(page_pdf)
+            print('Saved {}'.format(page))
 
     d = {}
     d['/Title'] = 'Sun * Moon * Tide {} Calendar'.format(tide_obj.year)
@@ -103,26 +417,80 @@ def generate_annual_calendar(tide_obj, sun_obj, moon_obj, file_name):
     
     print('Merging front and back matter into calendar... \
 (ignore PdfReadWarnings)')    
-    about_pdf = cal_pages.about('{}, {}'.format(tide_obj.station_name,
-                                                    tide_obj.state))
-    tech_pdf = cal_pages.tech(tide_obj)
-    merger = PdfFileMerger(strict = False)    
-    with open('temp.pdf','rb') as cal:
-        merger.append(PdfFileReader(cal))
-    with open(about_pdf,'rb') as about:
-        merger.merge(1, PdfFileReader(about))
-    with open(tech_pdf,'rb') as tech:
-        merger.append(PdfFileReader(tech))
+    about_pdf, tech_pdf = _matter_pdfs(tide_obj, cache)
+    merger = PdfFileMerger(strict = False)
+    if page_pdfs is None:
+        with open('temp.pdf','rb') as cal:
+            merger.append(PdfFileReader(cal))
+    else:
+        for page_pdf in page_pdfs:
+            merger.append(PdfFileReader(BytesIO(page_pdf)))
+    merger.merge(1, PdfFileReader(BytesIO(about_pdf)))
+    merger.append(PdfFileReader(BytesIO(tech_pdf)))
     merger.addMetadata(d)
     merger.write(file_name)
-                
+
     print('Cleaning up temporary files...')
-    os.remove('temp.pdf')
-    os.remove(about_pdf)
-    os.remove(tech_pdf)
+    if page_pdfs is None:
+        os.remove('temp.pdf')
     
     
-def month_page(month_string, tide_o, sun_o, moon_o):
+def render_pages(tide_obj, sun_obj, moon_obj, pages = None, format = 'png',
+                 dpi = 100, directory = None, processes = 1,
+                 profile = 'screen', cache = None):
+    '''Draw calendar pages as separate files, without merging them into the
+    PDF calendar: raster previews (PNG or WebP, drawn by Agg) or SVG. Much
+    cheaper than rasterizing the PDF calendar afterwards.
+
+    Args:
+    tide_obj, sun_obj, moon_obj: as for generate_annual_calendar
+    pages: list of page names, 'cover', 'yearview' or months such as
+                '2015-07' (default: all of them, see calendar_pages)
+    format: string, 'png', 'webp', 'svg', or any other format of savefig
+    dpi: resolution of raster pages, in dots per inch (850 x 1100 pixels at
+                the default of 100)
+    directory: if given, each page is written to a file in this directory,
+                named SunMoonTide_{year}_{station ID}_{page}.{format}
+    processes, profile, cache: as for generate_annual_calendar; profile
+                defaults to 'screen'. Pages are cached for each format and
+                dpi, so that e.g. a single month page can be redrawn with
+                pages = ['2015-07'] and format = 'pdf'.
+
+    Returns:
+    list, in the order of `pages`, of the file names if directory is given,
+    else of the bytes of each page
+    '''
+    if profile not in DECIMATION:
+        raise ValueError('In render_pages, profile must be one of {}, not \
+{}'.format(sorted(DECIMATION), profile))
+    if pages is None:
+        pages = calendar_pages(tide_obj.year)
+    for page in pages:
+        if page not in calendar_pages(tide_obj.year):
+            raise ValueError('In render_pages, pages must be cover, yearview \
+or months of {0} such as {0}-07, not {1}'.format(tide_obj.year, page))
+    return _save_pages(tide_obj, pages, format, directory,
+                       _drawn_pages(tide_obj, sun_obj, moon_obj, pages, format,
+                                    dpi, processes, profile, cache))
+
+
+def _save_pages(tide_obj, pages, format, directory, results):
+    '''Return the list of page bytes from `results`, or write them to files
+    in directory (if not None) and return the file names.'''
+    if directory is None:
+        return list(results)
+    file_names = []
+    for page, page_bytes in zip(pages, results):
+        file_name = os.path.join(directory, 'SunMoonTide_{}_{}_{}.{}'.format(
+            tide_obj.year, tide_obj.station_id, page, format))
+        with open(file_name, 'wb') as page_file:
+            page_file.write(page_bytes)
+        print('Saved {}'.format(file_name))
+        file_names.append(file_name)
+    return file_names
+
+
+def month_page(month_string, tide_o, sun_o, moon_o, profile = 'print'):
     '''Builds an 8.5x11" matplotlib Figure for a month page of the
     Sun * Moon * Tide calendar.
     
@@ -131,114 +499,82 @@ def month_page(month_string, tide_o, sun_o, moon_o):
         tide_o: tides.Tides object
         sun_o: astro.Astro object for 'Sun'
         moon_o: astro.Astro object for 'Moon'
-    
+        profile: 'print', 'screen' or 'full', see DECIMATION
+
     Returns:
-        fig: matplotlib.pyplot Figure object, ready for writing to PDF.
+        fig: matplotlib Figure object, ready for writing to PDF. It is this
+            process's month page template (see cal_template.py), reused by
+            the next call: write it out before drawing another month.
     '''
-    fig = plt.figure(figsize=(8.5,11))
-    
     # some renaming of things for readability
     tide_min, tide_max = tide_o.annual_min, tide_o.annual_max
     place_name = tide_o.station_name + ", " + tide_o.state
     month_title = pd.to_datetime(month_string).strftime('%B')
     year_title = tide_o.year
+    tolerance = DECIMATION[profile]
+    tide_margin = (tide_max - tide_min) / 60  # prevent overlap with spines
+    tide_ylim = (tide_min - 1.5 * tide_margin, tide_max + tide_margin)
+    year = pd.to_datetime(month_string).year
+    sun_days = day_slice_index(sun_o.altitudes, year)
+    moon_days = day_slice_index(moon_o.altitudes, year)
+    tide_days = day_slice_index(tide_o.all_tides, year)
+
+    template = month_template()
+    fig = template.new_page(month_title, str(year_title), place_name)
+    cells = template.cells  # cells[i] = gridspec gs[i] of a 12 x 7 grid
 
 #------------------ daily plot creator function -------------------
     def _plot_a_date(grid_index, date):
-        '''Internal function. Works on pre-defined gridspec gs and assumes
-        variables like tide_min, tide_max, month_of_tide/moon/sun already
-        defined in outer scope.
+        '''Internal function. Works on the template's grid cells and assumes
+        variables like tide_ylim and the DaySliceIndexes tide_days,
+        sun_days and moon_days already defined in outer scope.
         
-        Plots the two daily subplots for `date` in gridspec coordinates
-        gs[grid_index] for the sun/moon and gs[grid_index + 7] for tide.
+        Plots the two daily subplots for `date` in grid cells
+        cells[grid_index] for the sun/moon and cells[grid_index + 7] for tide.
         `date` must be a string in %Y-%m-%d format, i.e. '2015-07-18'.
         
         Returns ax1, ax2 = sun/moon (ax1) and tide (ax2) subplot handles
         '''
-        # need to extend the slices into neighboring dates to ensure smoothness
-        # (unless it is the first or last day of the year!)
-        yesterday = date_before(date)
-        tomorrow = date_after(date)
-
-        if date[5:] == '01-01':
-            sun_start = sun_o.altitudes.index[0]
-            moon_start = moon_o.altitudes.index[0]
-            tide_start = tide_o.all_tides.index[0]
-        else:
-            sun_start = sun_o.altitudes[yesterday].index[-10]
-            moon_start = moon_o.altitudes[yesterday].index[-10]
-            tide_start = tide_o.all_tides[yesterday].index[-10]
-        
-        if date[5:] == '12-31':
-            sun_stop = sun_o.altitudes.index[-1]
-            moon_stop = moon_o.altitudes.index[-1]
-            tide_stop = tide_o.all_tides.index[-1]
-        else:
-            sun_stop = sun_o.altitudes[tomorrow].index[10]
-            moon_stop = moon_o.altitudes[tomorrow].index[10]
-            tide_stop = tide_o.all_tides[tomorrow].index[10]
-        
-        day_of_sun = sun_o.altitudes[sun_start:sun_stop]
-        day_of_moon = moon_o.altitudes[moon_start:moon_stop]
-        day_of_tide = tide_o.all_tides[tide_start:tide_stop]
-        
-        # convert indices to matplotlib-friendly datetime format
-        Si = day_of_sun.index.to_pydatetime()
-        Mi = day_of_moon.index.to_pydatetime()
-        Ti = day_of_tide.index.to_pydatetime()
-        
-        # zeros for plotting the filled area under each curve
-        Sz = np.zeros(len(Si))
-        Mz = np.zeros(len(Mi))
-        Tz = np.zeros(len(Ti))
-        
-        # plot x-limits - need to be in matplotlib date number format
-        midnight0 = pd.to_datetime('{} 00:00'.format(date))
-        midnight0 = midnight0.tz_localize(tide_o.timezone).to_pydatetime()
-        midnight1 = pd.to_datetime('{} 00:00'.format(tomorrow))
-        midnight1 = midnight1.tz_localize(tide_o.timezone).to_pydatetime()
-        start_time = matplotlib.dates.date2num(midnight0)
-        stop_time = matplotlib.dates.date2num(midnight1)
-        
+        # the slices extend into neighboring dates to ensure smoothness
+        # (as far as the series goes, e.g. not before its first day!)
+        Si, day_of_sun = sun_days.padded(date)
+        Mi, day_of_moon = moon_days.padded(date)
+        Ti, day_of_tide = tide_days.padded(date)
+
+        # plot x-limits - in matplotlib date number format
+        start_time, stop_time = tide_days.limits(date)
+
         # sun and moon heights on top
-        ax1 = plt.subplot(gs[grid_index])
-        ax1.fill_between(Si, np.sin(day_of_sun), Sz, color = '#FFEB00',
-                         alpha = 0.25)  # the sunlight intensity
-        ax1.fill_between(Si, day_of_sun / (np.pi / 2), Sz, color = '#FFEB00',
-                         alpha = 1)  # the altitude angle
-        ax1.fill_between(Mi, day_of_moon / (np.pi / 2), Mz, color = '#D7A8A8',
-                         alpha = 0.25)
+        ax1 = cells[grid_index]
+        ax1.set_visible(True)
+        _fill_under(ax1, Si, np.sin(day_of_sun), (0, 1), tolerance,
+                    color = '#FFEB00', alpha = 0.25)  # the sunlight intensity
+        _fill_under(ax1, Si, day_of_sun / (np.pi / 2), (0, 1), tolerance,
+                    color = '#FFEB00', alpha = 1)  # the altitude angle
+        _fill_under(ax1, Mi, day_of_moon / (np.pi / 2), (0, 1), tolerance,
+                    color = '#D7A8A8', alpha = 0.25)
         ax1.set_xlim((start_time, stop_time))
         ax1.set_ylim((0, 1))
-        ax1.set_xticks([])
-        ax1.set_yticks([])
         for side in ['top', 'left', 'right']:
             ax1.spines[side].set_linewidth(1.5)
         ax1.spines['bottom'].set_visible(False)
         # add date number
-        plt.text(0.05, 0.73, pd.to_datetime(date).day, ha = 'left',
-                 fontsize = 14, fontname='Alegreya',
+        ax1.text(0.05, 0.73, pd.to_datetime(date).day, ha = 'left',
+                 fontproperties = font('Alegreya', 14),
                  transform = ax1.transAxes)
-        # add moon phase icon
-        moon_icon = '0ABCDEFGHIJKLM@NOPQRSTUVWXYZ'  # the dark part
-        plt.text(0.96, 0.69, moon_icon[moon_o.phase_day_num[date]],
-                 ha = 'right', fontsize = 12, color = '0.75',
-                 fontname = 'moon phases', transform = ax1.transAxes)
-        plt.text(0.96, 0.69, '*',   # the white part
-                 ha = 'right', fontsize = 12, color = '#D7A8A8', alpha = 0.25,
-                 fontname = 'moon phases', transform = ax1.transAxes)
-        plt.text(0.96, 0.69, '@',   # the outline
-                 ha = 'right', fontsize = 12, color = 'black',
-                 fontname = 'moon phases', transform = ax1.transAxes)
+        # moon phase icon at (0.96, 0.69) in ax1, drawn with the others below
+        cell = ax1.get_position()
+        moon_offsets.append((cell.x0 + 0.96 * cell.width,
+                             cell.y0 + 0.69 * cell.height))
+        moon_glyphs.append(MOON_PHASE_GLYPHS[moon_o.phase_day_num[date]])
         
         # tide magnitudes below
-        ax2 = plt.subplot(gs[grid_index + 7])
-        ax2.fill_between(Ti, day_of_tide, Tz, color = '#52ABB7', alpha = 0.8)
+        ax2 = cells[grid_index + 7]
+        ax2.set_visible(True)
+        _fill_under(ax2, Ti, day_of_tide, tide_ylim, tolerance,
+                    color = '#52ABB7', alpha = 0.8)
         ax2.set_xlim((start_time, stop_time))
-        tide_margin = (tide_max - tide_min) / 60  # prevent overlap with spines
-        ax2.set_ylim((tide_min - 1.5 * tide_margin, tide_max + tide_margin))
-        ax2.set_xticks([])
-        ax2.set_yticks([])
+        ax2.set_ylim(tide_ylim)
         for side in ['bottom', 'left', 'right']:
             ax2.spines[side].set_linewidth(1.5)
         ax2.spines['top'].set_linewidth(0.5)
@@ -247,8 +583,8 @@ def month_page(month_string, tide_o, sun_o, moon_o):
         return ax1, ax2
     
 # ---------------- build grid of daily plots ---------------------
-    gs = gridspec.GridSpec(12, 7, wspace = 0.0, hspace = 0.0)
     daily_axes = [] # daily_axes[i] = sun/moon axes for date i+1
+    moon_offsets, moon_glyphs = [], []  # filled in by _plot_a_date
 
     # dayofweek --> Monday=0, Sunday=6. Our week starts on Sunday.
     init_day = (pd.to_datetime(month_string + '-01').dayofweek + 1) % 7
@@ -260,10 +596,10 @@ def month_page(month_string, tide_o, sun_o, moon_o):
             gridnum += 8  # skip down a full row to leave tide subplots intact
         else:
             gridnum += 1
-
-    # give us some better margins
-    fig.subplots_adjust(left = 0.05, right = 0.95, bottom = 0.1, top = 0.8,
-                        hspace = 0.0, wspace = 0.0)
+    # above every daily axes, including a solstice/equinox day's (zorder
+    # 1000), whose background would otherwise hide its icon
+    add_moon_icons(fig, moon_offsets, moon_glyphs, fig.transFigure,
+                   zorder = 2000)
 
     # add solstice or equinox icon, if needed this month
     sun_icon_col = {
@@ -285,21 +621,14 @@ def month_page(month_string, tide_o, sun_o, moon_o):
 
         
 
-    # add empty date boxes, figure annotations and titles
-    day_names = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday',
-                 'Friday', 'Saturday']
-    for i in range(init_day, 7):  # day-of-week labels on top row subplots
-        plt.text(0.5, 1.08, day_names[i],
-                 horizontalalignment = 'center',
-                 fontsize = 12, fontname = 'Alegreya',
-                 transform = daily_axes[i - init_day].transAxes)
+    # add empty date boxes (day-of-week labels, titles and footer text are
+    # in the template)
     for i in range(init_day):  # handle the blank boxes on top row
-        temp_ax = plt.subplot(gs[i])
-        temp2_ax = plt.subplot(gs[i + 7])
-        temp_ax.set_xticks([])
-        temp_ax.set_yticks([])
-        temp2_ax.set_xticks([])
-        temp2_ax.set_yticks([])
+        temp_ax = cells[i]
+        temp2_ax = cells[i + 7]
+        for blank_ax in [temp_ax, temp2_ax]:
+            blank_ax.set_visible(True)
+            blank_ax.set_zorder(0.5)  # spines over the first day's spines
         for side in ['left', 'right']:
             temp_ax.spines[side].set_linewidth(0.5)
             temp2_ax.spines[side].set_linewidth(0.5)
@@ -313,29 +642,7 @@ def month_page(month_string, tide_o, sun_o, moon_o):
         temp2_ax.spines['top'].set_linewidth(0.0)
         temp_ax.spines['top'].set_linewidth(1.5)
         temp2_ax.spines['bottom'].set_linewidth(1.5)
-        plt.text(0.5, 1.08, day_names[i],     # doy-of-week labels on blanks
-                     horizontalalignment = 'center',
-                     fontsize = 12, fontname = 'Alegreya',
-                     transform = temp_ax.transAxes)
-
-    # title and footer text
-    fig.text(0.08, 0.875, month_title, horizontalalignment = 'left',
-             fontsize = '72', fontname = 'Alegreya SC')
-    fig.text(0.92, 0.875, year_title, horizontalalignment = 'right',
-             fontsize = '72', fontname = 'Alegreya SC')
-    fig.text(0.92, 0.1, place_name, horizontalalignment = 'right',
-             fontsize = '16', fontname = 'Alegreya')
-    fig.text(0.92, 0.13, 'Sun * Moon * Tide', horizontalalignment = 'right',
-             fontsize = '36', fontname = 'FoglihtenNo01')
-    # cruzviz logo on footer
-    try:
-        logo = pkgutil.get_data('cal_draw', 'graphics/logo.png')
-        im = Image.open(BytesIO(logo))
-        im = np.array(im).astype(np.float) / 255
-        fig.figimage(im, xo = 505, yo = 70)
-    except Exception as e:
-        print('Could not load logo image. Error: ' + e)  # no exception raised
-    
+
     return fig
 
 
@@ -362,19 +669,9 @@ def cover(tide):
     for frac in np.linspace(0, 1, 20):
         ax.plot(frac * x, frac * y, '-',color = '#52ABB7', lw = 3, alpha = 0.5)
     #ax.plot(4 * cos(theta), 4 * sin(theta), '--', c = 'red')  # moon placement check
-    for daynum in range(16):
-        th = moontheta[daynum]
-        mx = 2 * R * np.cos(th) + o
-        my = 2 * R * np.sin(th) - o
-        # the dark part
-        ax.text(mx, my, moon_icon[daynum], ha = 'right', fontsize = 12,
-                color = '0.75', fontname = 'moon phases')
-        # the white part
-        ax.text(mx, my, '*', ha = 'right', fontsize = 12, 
-                color = '#D7A8A8', alpha = 0.25, fontname = 'moon phases')
-        # the outline
-        ax.text(mx, my, '@', ha = 'right', fontsize = 12,
-                color = 'black', fontname = 'moon phases', zorder = 20)
+    mx = 2 * R * np.cos(moontheta) + o
+    my = 2 * R * np.sin(moontheta) - o
+    add_moon_icons(ax, np.column_stack([mx, my]), moon_icon, ax.transData)
 
 
     # the sun
@@ -402,9 +699,14 @@ def cover(tide):
     return fig
 
 
-def yearview(tide_o, sun_o, moon_o):
+def yearview(tide_o, sun_o, moon_o, profile = 'print'):
     """Returns a matplotlib.pyplot Figure object, ready to write to PDF.
+    profile is 'print', 'screen' or 'full', see DECIMATION.
     """
+    tolerance = DECIMATION[profile]
+    tide_margin = (tide_o.annual_max - tide_o.annual_min) / 60
+    tide_ylim = (tide_o.annual_min - 1.5 * tide_margin,
+                 tide_o.annual_max + tide_margin)
     fig = plt.figure(figsize=(8.5,11))
     fig.text(0.5, 0.875, '{} Overview'.format(tide_o.year),
              horizontalalignment = 'center', fontsize = '48',
@@ -428,6 +730,7 @@ def yearview(tide_o, sun_o, moon_o):
     month_chunks = [allmonths[:3], allmonths[3:6], allmonths[6:9],
                     allmonths[9:]]
     
+    moon_offsets, moon_glyphs = [], []  # full/new moon icons, on the figure
     for chunk, gsi in zip(month_chunks, gsx):
         for ind in [0, 1, 2]:
             month = chunk[ind]
@@ -435,28 +738,23 @@ def yearview(tide_o, sun_o, moon_o):
             month_of_moon = moon_o.altitudes[month]
             month_of_tide = tide_o.all_tides[month]
 
-            # convert indices to matplotlib-friendly datetime format
-            Si = month_of_sun.index.to_pydatetime()
-            Mi = month_of_moon.index.to_pydatetime()
-            Ti = month_of_tide.index.to_pydatetime()
-
-            # zeros for plotting the filled area under each curve
-            Sz = np.zeros(len(Si))
-            Mz = np.zeros(len(Mi))
-            Tz = np.zeros(len(Ti))
+            # convert indices to matplotlib date numbers
+            Si = matplotlib.dates.date2num(month_of_sun.index.to_pydatetime())
+            Mi = matplotlib.dates.date2num(month_of_moon.index.to_pydatetime())
+            Ti = matplotlib.dates.date2num(month_of_tide.index.to_pydatetime())
 
             # x-limits based on first and last tide interp time - for
             # cases where only have one or two hi/lo tides per day 
             # - no more odd cut offs near borders
-            start_time = matplotlib.dates.date2num(Ti[0])
-            stop_time = matplotlib.dates.date2num(Ti[-1])
+            start_time = Ti[0]
+            stop_time = Ti[-1]
 
             # sun and moon heights on top
             ax1 = plt.subplot(gsi[ind])
-            ax1.fill_between(Si, month_of_sun / (np.pi / 2), Sz, 
-                             color = '#FFEB00', alpha = 1)  # altitude angle
-            ax1.fill_between(Mi, month_of_moon / (np.pi / 2), Mz, 
-                             color = '#D7A8A8', alpha = 0.25)
+            _fill_under(ax1, Si, month_of_sun / (np.pi / 2), (0, 1),
+                        tolerance, color = '#FFEB00', alpha = 1)  # altitude
+            _fill_under(ax1, Mi, month_of_moon / (np.pi / 2), (0, 1),
+                        tolerance, color = '#D7A8A8', alpha = 0.25)
             ax1.set_xlim((start_time, stop_time))
             ax1.set_ylim((0, 1))
             ax1.set_xticks([])
@@ -467,33 +765,15 @@ def yearview(tide_o, sun_o, moon_o):
 
             # add full/new moon icon(s)
             luns = moon_o.half_phases[month]            
-            if luns[luns == 'full'].any():
-                full_moon_times = luns[luns == 'full'].index.to_pydatetime()
-                for moontime in full_moon_times:
-                    ax1.text(moontime, 0.69, '@',   # the dark part
-                         ha = 'left', fontsize = 12, color = '0.75',
-                         fontname = 'moon phases', zorder = 1400)
-                    ax1.text(moontime, 0.69, '*',   # the white part
-                         ha = 'left', fontsize = 12, color = '#D7A8A8',
-                         alpha = 0.25, fontname = 'moon phases',
-                         zorder = 1410)
-                    ax1.text(moontime, 0.69, '@',   # the outline
-                             ha = 'left', fontsize = 12, color = 'black',
-                             fontname = 'moon phases', zorder = 1520)
-
-            if luns[luns == 'new'].any():
-                new_moon_times = luns[luns == 'new'].index.to_pydatetime()
-                for moontime in new_moon_times:
-                    ax1.text(moontime, 0.69, '0',   # the dark part
-                             ha = 'left', fontsize = 12, color = '0.75',
-                             fontname = 'moon phases', zorder = 1500)
-                    ax1.text(moontime, 0.69, '*',   # the white part
-                             ha = 'left', fontsize = 12, color = '#D7A8A8',
-                             alpha = 0.25, fontname = 'moon phases',
-                             zorder = 1510)
-                    ax1.text(moontime, 0.69, '@',   # the outline
-                             ha = 'left', fontsize = 12, color = 'black',
-                             fontname = 'moon phases', zorder = 1520)
+            full_new = luns[(luns == 'full') | (luns == 'new')]
+            if len(full_new):
+                moon_times = matplotlib.dates.date2num(
+                    full_new.index.to_pydatetime())
+                to_figure = ax1.transData + fig.transFigure.inverted()
+                moon_offsets.extend(to_figure.transform(
+                    [(t, 0.69) for t in moon_times]))
+                moon_glyphs.extend('@' if lun == 'full' else '0'
+                                   for lun in full_new)
 
 
             if luns.index[-1].day > 25:
@@ -524,17 +804,18 @@ def yearview(tide_o, sun_o, moon_o):
                 
             # tide magnitudes below
             ax2 = plt.subplot(gsi[ind + 3])
-            ax2.fill_between(Ti, month_of_tide, Tz, 
-                             color = '#52ABB7', alpha = 0.8)
+            _fill_under(ax2, Ti, month_of_tide, tide_ylim, tolerance,
+                        color = '#52ABB7', alpha = 0.8)
             ax2.set_xlim((start_time, stop_time))
-            tide_margin = (tide_o.annual_max - tide_o.annual_min) / 60
-            ax2.set_ylim((tide_o.annual_min - 1.5 * tide_margin, 
-                          tide_o.annual_max + tide_margin))
+            ax2.set_ylim(tide_ylim)
             ax2.set_xticks([])
             ax2.set_yticks([])
             for side in ['bottom', 'left', 'right']:
                 ax2.spines[side].set_linewidth(1.5)
             ax2.spines['top'].set_linewidth(0.5)
             ax2.set_zorder(1500)
-    
+
+    # above all the month axes, where they cross into the next month
+    add_moon_icons(fig, moon_offsets, moon_glyphs, fig.transFigure,
+                   ha = 'left', zorder = 10000)
     return fig
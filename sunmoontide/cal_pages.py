@@ -60,7 +60,24 @@ def tech(tide):
     """Creates a multi-page PDF for the Technical Details section in the
     current working directory, and returns its filename.
     """
-    if tide.station_type == 'subordinate' and tide.height_offset_low > 50:
+    additive = (tide.station_type == 'subordinate' and
+                (tide.height_addition_high or tide.height_addition_low))
+    if additive:
+        def _height(kind, percent, addition):
+            heights = 'the reference station {} tide heights'.format(kind)
+            if percent != 100:
+                heights = '{}% of {}'.format(percent, heights)
+            if addition:
+                heights += ' offset by {:+g} ft'.format(addition)
+            return heights
+        optstring = 'The predictions are referenced to {0.ref_station_name} \
+(station ID: {0.ref_station_id}). High tide heights are {1}, and low tide \
+heights are {2}. Times are offset from the reference station high and low \
+times by {0.time_offset_high} and {0.time_offset_low} minutes, \
+respectively.</p>'.format(tide,
+            _height('high', tide.height_offset_high, tide.height_addition_high),
+            _height('low', tide.height_offset_low, tide.height_addition_low))
+    elif tide.station_type == 'subordinate' and tide.height_offset_low > 50:
         optstring = 'The predictions are referenced to {0.ref_station_name} \
 (station ID: {0.ref_station_id}). High and low tide heights are \
 {0.height_offset_high}% and {0.height_offset_low}% of the reference station \
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the static layers of the calendar's month pages: the 12 x 7 grid of
+daily axes, day-of-week labels, title and footer text and the CruzViz logo.
+They are the same on every month page, so they are built once per process
+(see `month_template`) and month_page in cal_draw.py only adds each month's
+data to them. Also the moon phase icons of all pages, whose outlines are made
+once per process (see `add_moon_icons`).
+"""
+from functools import lru_cache
+from io import BytesIO
+import pkgutil
+
+from matplotlib.collections import PathCollection
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties
+from matplotlib.gridspec import GridSpec
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D
+import numpy as np
+from PIL import Image
+
+# month page grid: 12 rows of 7 days, alternating sun/moon and tide rows,
+# inside these margins (fractions of the 8.5x11" page)
+GRID_ROWS, GRID_COLUMNS = 12, 7
+GRID_LEFT, GRID_RIGHT, GRID_BOTTOM, GRID_TOP = 0.05, 0.95, 0.1, 0.8
+
+# graphics/logo.png is a 300 dpi image, placed this many dots from the bottom
+# left corner of the page
+LOGO_DPI = 300
+LOGO_ORIGIN = (505, 70)
+
+# The 'moon phases' font has a glyph for the dark part of the moon on each day
+# of the lunar cycle, starting at new moon ('0'; '@' is full moon). An icon
+# is that glyph, a '*' for the white part and a '@' outline, in these colors.
+MOON_PHASE_GLYPHS = '0ABCDEFGHIJKLM@NOPQRSTUVWXYZ'
+MOON_ICON_COLORS = [to_rgba('0.75'), to_rgba('#D7A8A8', 0.25),
+                    to_rgba('black')]
+
+DAY_NAMES = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday',
+             'Friday', 'Saturday']
+
+
+@lru_cache(maxsize = None)
+def font(family, size):
+    """A FontProperties for a font family and size, made once and shared by
+    every text using them (matplotlib looks the font file up once)."""
+    return FontProperties(family = family, size = size)
+
+
+@lru_cache(maxsize = None)
+def logo_image():
+    """The CruzViz logo, graphics/logo.png, decoded once as an array of floats
+    in 0 to 1 for Figure.figimage, or None if it cannot be loaded."""
+    try:
+        logo = pkgutil.get_data('cal_template', 'graphics/logo.png')
+        im = Image.open(BytesIO(logo))
+        return np.array(im).astype(float) / 255
+    except Exception as e:
+        print('Could not load logo image. Error: {}'.format(e))
+        return None  # no exception raised
+
+
+@lru_cache(maxsize = None)
+def cell_rects():
+    """Figure coordinates [left, bottom, width, height] of the month page
+    grid cells, in the order of GridSpec(12, 7) indices: row by row from the
+    top left.
+
+    Example:
+    >>> np.round(cell_rects()[8], 4)
+    array([0.1786, 0.6833, 0.1286, 0.0583])
+    """
+    fig = Figure(figsize = (8.5, 11))
+    gs = GridSpec(GRID_ROWS, GRID_COLUMNS, left = GRID_LEFT,
+                  right = GRID_RIGHT, bottom = GRID_BOTTOM, top = GRID_TOP,
+                  wspace = 0.0, hspace = 0.0)
+    return [np.array(gs[i].get_position(fig).bounds)
+            for i in range(GRID_ROWS * GRID_COLUMNS)]
+
+
+@lru_cache(maxsize = None)
+def moon_icon_paths(glyph, size = 12, ha = 'right'):
+    """Outlines, in points, of the three layers of the moon phase icon for
+    `glyph` (see MOON_PHASE_GLYPHS) in the 'moon phases' font at `size`
+    points, each placed as matplotlib places text with baseline at 0 and
+    horizontal alignment `ha` ('left', 'center' or 'right') at 0. Made once
+    per process for each glyph.
+    """
+    paths = []
+    for char in [glyph, '*', '@']:
+        path = TextPath((0, 0), char, size = size,
+                        prop = font('moon phases', size))
+        extents = path.get_extents()
+        shift = {'left': -extents.x0, 'center': -(extents.x0 + extents.x1) / 2,
+                 'right': -extents.x1}[ha]
+        paths.append(path.transformed(Affine2D().translate(shift, 0)))
+    return paths
+
+
+def add_moon_icons(parent, offsets, glyphs, transform, size = 12,
+                   ha = 'right', zorder = 3):
+    """Draw moon phase icons in `parent`, an Axes or Figure: the icon for
+    glyphs[i] (see MOON_PHASE_GLYPHS) at offsets[i], an (x, y) pair in
+    `transform`, aligned like text with horizontal alignment `ha`.
+
+    The icons are a few artists, however many there are, in place of three
+    texts each: a PathCollection of the dark parts for each glyph, then one of
+    the white parts and one of the outlines. Each is one path at several
+    offsets, which the PDF backend writes once, as an XObject. Returns the
+    PathCollections.
+    """
+    offsets = np.asarray(offsets, dtype = float).reshape(-1, 2)
+    glyphs = np.asarray(list(glyphs))
+    points = Affine2D().scale(1 / 72.) + parent.figure.dpi_scale_trans
+    white, outline = moon_icon_paths('@', size, ha)[1:]
+    layers = [(moon_icon_paths(glyph, size, ha)[0], MOON_ICON_COLORS[0],
+               offsets[glyphs == glyph]) for glyph in np.unique(glyphs)]
+    layers += [(white, MOON_ICON_COLORS[1], offsets),
+               (outline, MOON_ICON_COLORS[2], offsets)]
+    icons = []
+    for path, color, layer_offsets in layers:
+        icon = PathCollection([path], facecolors = [color],
+                              edgecolors = 'none', linewidths = 0,
+                              offsets = layer_offsets,
+                              offset_transform = transform,
+                              transform = points, zorder = zorder,
+                              clip_on = False)
+        if hasattr(parent, 'add_collection'):
+            parent.add_collection(icon, autolim = False)
+        else:
+            parent.add_artist(icon)
+        icons.append(icon)
+    return icons
+
+
+class MonthTemplate:
+    """An 8.5x11" Figure holding the static layers of a month page, reused
+    for every month: the grid cell axes (without ticks), day-of-week labels,
+    the footer and the logo. `new_page` clears the previous month's data.
+
+    Attributes:
+        fig: matplotlib.figure.Figure
+        cells: list of the 84 grid cell Axes, indexed like GridSpec(12, 7)
+    """
+    def __init__(self):
+        self.fig = Figure(figsize = (8.5, 11))
+        self.cells = []
+        for rect in cell_rects():
+            ax = self.fig.add_axes(rect)
+            ax.set_xticks([])
+            ax.set_yticks([])
+            self.cells.append(ax)
+
+        # day-of-week labels above the top row, at (0.5, 1.08) in its axes
+        for rect, day_name in zip(cell_rects(), DAY_NAMES):
+            left, bottom, width, height = rect
+            self.fig.text(left + 0.5 * width, bottom + 1.08 * height,
+                          day_name, horizontalalignment = 'center',
+                          fontproperties = font('Alegreya', 12))
+
+        # title and footer text
+        self.month_title = self.fig.text(0.08, 0.875, '',
+            horizontalalignment = 'left',
+            fontproperties = font('Alegreya SC', 72))
+        self.year_title = self.fig.text(0.92, 0.875, '',
+            horizontalalignment = 'right',
+            fontproperties = font('Alegreya SC', 72))
+        self.place_name = self.fig.text(0.92, 0.1, '',
+            horizontalalignment = 'right',
+            fontproperties = font('Alegreya', 16))
+        self.fig.text(0.92, 0.13, 'Sun * Moon * Tide',
+                      horizontalalignment = 'right',
+                      fontproperties = font('FoglihtenNo01', 36))
+        # cruzviz logo on footer, in its own axes so that it keeps its size
+        # and place on the page at any dpi
+        if logo_image() is not None:
+            height, width = logo_image().shape[:2]
+            page_width, page_height = self.fig.get_size_inches() * LOGO_DPI
+            ax = self.fig.add_axes([LOGO_ORIGIN[0] / page_width,
+                                    LOGO_ORIGIN[1] / page_height,
+                                    width / page_width, height / page_height])
+            ax.imshow(logo_image(), interpolation = 'none', aspect = 'auto')
+            ax.axis('off')
+
+    def new_page(self, month_title, year_title, place_name):
+        """Clear the data of the previous month from the grid cells, hide
+        them all with their default spines and zorder (month_page shows
+        the cells it uses), set the title and footer text, and return the
+        figure."""
+        for artist in list(self.fig.artists):  # moon icons
+            artist.remove()
+        for ax in self.cells:
+            for artist in (list(ax.collections) + list(ax.texts) +
+                           list(ax.patches) + list(ax.lines)):
+                artist.remove()
+            for spine in ax.spines.values():
+                spine.set_visible(True)
+            ax.set_zorder(0)
+            ax.set_visible(False)
+        self.month_title.set_text(month_title)
+        self.year_title.set_text(year_title)
+        self.place_name.set_text(place_name)
+        return self.fig
+
+
+@lru_cache(maxsize = None)
+def month_template():
+    """The MonthTemplate of this process, built on first use."""
+    return MonthTemplate()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Module to simplify the sampled curves of the calendar before they are drawn.
+The sun, moon and tide curves are sampled every few minutes, far more finely
+than a day's box on the page can show, and every sample becomes a vertex in
+the PDF. `simplify` drops the samples that the page cannot show, keeping the
+curve within a given error (in points, 1/72 inch) with the Ramer-Douglas-
+Peucker algorithm. See `DECIMATION` in cal_draw.py for the error used by each
+output profile.
+"""
+import numpy as np
+
+
+def rdp_mask(x, y, tolerance):
+    """Return a boolean mask of the points of the curve (x, y) kept by the
+    Ramer-Douglas-Peucker algorithm: the first and last points, and
+    recursively the point farthest from the line through the points kept on
+    either side of it, until no dropped point is farther than `tolerance`.
+    Distances are vertical (x must be increasing), so the simplified curve is
+    within `tolerance` of every original point, above or below.
+
+    Arguments:
+        x, y (1D arrays of floats): the curve, without NaNs
+        tolerance (float): the maximum error, in the units of y
+
+    Example:
+    >>> x = np.arange(7.)
+    >>> rdp_mask(x, np.array([0., 0.1, 0., 2., 4., 4., 4.]), 0.5)
+    array([ True, False,  True, False,  True, False,  True])
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = np.zeros(len(x), dtype=bool)
+    if len(x) == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, len(x) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        slope = (y[last] - y[first]) / (x[last] - x[first])
+        between = slice(first + 1, last)
+        error = np.abs(y[between] - y[first] - slope * (x[between] - x[first]))
+        farthest = int(np.argmax(error))
+        if error[farthest] > tolerance:
+            farthest += first + 1
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return keep
+
+
+def simplify(x, y, tolerance, ylim, height):
+    """Simplify a curve drawn in a box `height` points high showing y from
+    ylim[0] to ylim[1], so that it stays within `tolerance` points of the
+    original where it is visible. y is first clamped to one point beyond
+    ylim, as nothing further is seen (and a line of up to 1 point drawn along
+    the curve stays out of sight): a curve that stays below the box (a body
+    below the horizon) needs only its ends. NaNs, which break matplotlib's fills, are
+    kept, and the runs between them are simplified separately.
+
+    Arguments:
+        x, y (1D arrays of floats): the curve, x increasing
+        tolerance (float): maximum error in points, or None to keep all
+        ylim: (low, high) y limits of the box
+        height (float): height of the box in points
+
+    Returns:
+        x, y: the simplified curve, as arrays
+
+    Example:
+    >>> t = np.linspace(0, 1, 1001)
+    >>> x, y = simplify(t, np.sin(2 * np.pi * t), 0.25, (0, 1), 40)
+    >>> len(x), y.min()
+    (19, -0.025)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if tolerance is None or len(x) < 3:
+        return x, y
+    point = abs(ylim[1] - ylim[0]) / height  # in units of y
+    with np.errstate(invalid='ignore'):
+        y = np.clip(y, min(ylim) - point, max(ylim) + point)
+    tolerance = tolerance * point
+    finite = np.isfinite(y)
+    keep = ~finite
+    # runs of finite values, between NaNs
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], finite, [0]])))
+    for start, stop in zip(edges[::2], edges[1::2]):
+        keep[start:stop] = rdp_mask(x[start:stop], y[start:stop], tolerance)
+    return x[keep], y[keep]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
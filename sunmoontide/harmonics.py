@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+This module predicts tides from harmonic constituents (amplitudes and
+Greenwich phase lags) for any time range, and extracts the high and low
+tides, as an alternative to NOAA Annual Tide Prediction text files. See
+`Tides.from_harmonics` in tides.py.
+
+Constituent arguments, node factors (f) and nodal corrections (u) follow
+Schureman, "Manual of Harmonic Analysis and Prediction of Tides" (1958),
+which is the convention of NOAA's published harmonic constants.
+"""
+
+import numpy as np
+import pandas as pd
+
+from tides import open_noaa_source, _source_name
+
+D2R = np.pi / 180.
+R2D = 180. / np.pi
+
+# Equilibrium arguments V as coefficients of
+# (T, s, h, p, p1, degrees): T = hour angle of the mean sun at Greenwich,
+# s, h, p, p1 = mean longitudes of the moon, sun, lunar perigee and solar
+# perigee. Plus the node factor/correction formula to use (see _node).
+CONSTITUENTS = {
+    'M2':   ((2, -2,  2,  0,  0,    0), 'M2'),
+    'S2':   ((2,  0,  0,  0,  0,    0), None),
+    'N2':   ((2, -3,  2,  1,  0,    0), 'M2'),
+    'K1':   ((1,  0,  1,  0,  0,  -90), 'K1'),
+    'M4':   ((4, -4,  4,  0,  0,    0), 'M4'),
+    'O1':   ((1, -2,  1,  0,  0,   90), 'O1'),
+    'M6':   ((6, -6,  6,  0,  0,    0), 'M6'),
+    'MK3':  ((3, -2,  3,  0,  0,  -90), 'MK3'),
+    'S4':   ((4,  0,  0,  0,  0,    0), None),
+    'MN4':  ((4, -5,  4,  1,  0,    0), 'M4'),
+    'NU2':  ((2, -3,  4, -1,  0,    0), 'M2'),
+    'S6':   ((6,  0,  0,  0,  0,    0), None),
+    'MU2':  ((2, -4,  4,  0,  0,    0), 'M2'),
+    '2N2':  ((2, -4,  2,  2,  0,    0), 'M2'),
+    'OO1':  ((1,  2,  1,  0,  0,  -90), 'OO1'),
+    'LAM2': ((2, -1,  0,  1,  0,  180), 'M2'),
+    'S1':   ((1,  0,  0,  0,  0,    0), None),
+    'M1':   ((1, -1,  1,  0,  0,  -90), 'M1'),
+    'J1':   ((1,  1,  1, -1,  0,  -90), 'J1'),
+    'MM':   ((0,  1,  0, -1,  0,    0), 'MM'),
+    'SSA':  ((0,  0,  2,  0,  0,    0), None),
+    'SA':   ((0,  0,  1,  0,  0,    0), None),
+    'MSF':  ((0,  2, -2,  0,  0,    0), 'MSF'),
+    'MF':   ((0,  2,  0,  0,  0,    0), 'MF'),
+    'RHO':  ((1, -3,  3, -1,  0,   90), 'O1'),
+    'Q1':   ((1, -3,  1,  1,  0,   90), 'O1'),
+    'T2':   ((2,  0, -1,  0,  1,    0), None),
+    'R2':   ((2,  0,  1,  0, -1,  180), None),
+    '2Q1':  ((1, -4,  1,  2,  0,   90), 'O1'),
+    'P1':   ((1,  0, -1,  0,  0,   90), None),
+    '2SM2': ((2,  2, -2,  0,  0,    0), 'MSF'),
+    'M3':   ((3, -3,  3,  0,  0,  180), 'M3'),
+    'L2':   ((2, -1,  2, -1,  0,  180), 'L2'),
+    '2MK3': ((3, -4,  3,  0,  0,   90), '2MK3'),
+    'K2':   ((2,  0,  2,  0,  0,    0), 'K2'),
+    'M8':   ((8, -8,  8,  0,  0,    0), 'M8'),
+    'MS4':  ((4, -2,  2,  0,  0,    0), 'M2'),
+}
+# common alternative names
+CONSTITUENTS['RHO1'] = CONSTITUENTS['RHO']
+CONSTITUENTS['LAMBDA2'] = CONSTITUENTS['LAM2']
+
+
+def astronomical_arguments(times):
+    """Return the astronomical arguments used by `CONSTITUENTS` at the given
+    times (int64 nanoseconds since the epoch, UTC), as a dict of float
+    arrays in degrees: T, s, h, p, p1 and N (longitude of the moon's
+    ascending node). Mean longitudes are the Meeus polynomials; UT is used
+    for TT (the difference is negligible here).
+    """
+    times = np.asarray(times, dtype=np.int64)
+    days = times / 86400e9                       # days since 1970-01-01
+    c = (days - 10957.5) / 36525.                # centuries since J2000.0
+    return {
+        'T': 180. + 360. * (days % 1.),
+        's': 218.3164591 + 481267.88134236 * c - 0.0013268 * c**2,
+        'h': 280.4664567 + 36000.76982779 * c + 0.0003032 * c**2,
+        'p': 83.3532430 + 4069.0137111 * c - 0.0103238 * c**2,
+        'p1': 282.9373 + 1.71945766667 * c,
+        'N': 125.0445550 - 1934.1361849 * c + 0.0020762 * c**2,
+    }
+
+
+def _node(kind, args):
+    """Return node factor f and nodal correction u (degrees) for a node
+    formula name from `CONSTITUENTS`, per Schureman."""
+    if kind is None:
+        return 1., 0.
+    omega, i = 23.452 * D2R, 5.145 * D2R    # obliquity, lunar inclination
+    N = args['N'] * D2R
+    cosI = np.cos(i) * np.cos(omega) - np.sin(i) * np.sin(omega) * np.cos(N)
+    I = np.arccos(cosI)
+    e1 = np.arctan(np.cos(0.5 * (omega - i)) / np.cos(0.5 * (omega + i))
+                   * np.tan(0.5 * N)) - 0.5 * N
+    e2 = np.arctan(np.sin(0.5 * (omega - i)) / np.sin(0.5 * (omega + i))
+                   * np.tan(0.5 * N)) - 0.5 * N
+    xi, nu = -(e1 + e2), e1 - e2
+
+    if kind == 'M2':
+        return np.cos(I / 2)**4 / 0.9154, (2 * xi - 2 * nu) * R2D
+    if kind == 'O1':
+        return (np.sin(I) * np.cos(I / 2)**2 / 0.3800,
+                (2 * xi - nu) * R2D)
+    if kind == 'K1':
+        nup = np.arctan(np.sin(2 * I) * np.sin(nu) /
+                        (np.sin(2 * I) * np.cos(nu) + 0.3347))
+        f = np.sqrt(0.8965 * np.sin(2 * I)**2 +
+                    0.6001 * np.sin(2 * I) * np.cos(nu) + 0.1006)
+        return f, -nup * R2D
+    if kind == 'K2':
+        nupp = 0.5 * np.arctan(np.sin(I)**2 * np.sin(2 * nu) /
+                               (np.sin(I)**2 * np.cos(2 * nu) + 0.0727))
+        f = np.sqrt(19.0444 * np.sin(I)**4 +
+                    2.7702 * np.sin(I)**2 * np.cos(2 * nu) + 0.0981)
+        return f, -2 * nupp * R2D
+    if kind == 'J1':
+        return np.sin(2 * I) / 0.7214, -nu * R2D
+    if kind == 'OO1':
+        return (np.sin(I) * np.sin(I / 2)**2 / 0.0164,
+                (-2 * xi - nu) * R2D)
+    if kind == 'MM':
+        return (2. / 3. - np.sin(I)**2) / 0.5021, 0.
+    if kind == 'MF':
+        return np.sin(I)**2 / 0.1578, -2 * xi * R2D
+    if kind == 'M1':
+        P = args['p'] * D2R - xi
+        f_O1, u_O1 = _node('O1', args)
+        inv_Qa = np.sqrt(0.25 + 1.5 * np.cos(I) * np.cos(2 * P) /
+                         np.cos(I / 2)**2 +
+                         2.25 * np.cos(I)**2 / np.cos(I / 2)**4)
+        Q = np.arctan((5 * np.cos(I) - 1) * np.tan(P) / (7 * np.cos(I) + 1))
+        return f_O1 * inv_Qa, (xi - nu + Q) * R2D
+    if kind == 'L2':
+        P = args['p'] * D2R - xi
+        f_M2, u_M2 = _node('M2', args)
+        tan2 = np.tan(I / 2)**2
+        inv_Ra = np.sqrt(1 - 12 * tan2 * np.cos(2 * P) + 36 * tan2**2)
+        R = np.arctan(np.sin(2 * P) / (1. / (6 * tan2) - np.cos(2 * P)))
+        return f_M2 * inv_Ra, u_M2 - R * R2D
+    # compound constituents
+    f_M2, u_M2 = _node('M2', args)
+    if kind == 'M4':
+        return f_M2**2, 2 * u_M2
+    if kind == 'M6':
+        return f_M2**3, 3 * u_M2
+    if kind == 'M8':
+        return f_M2**4, 4 * u_M2
+    if kind == 'M3':
+        return f_M2**1.5, 1.5 * u_M2
+    if kind == 'MSF':
+        return f_M2, -u_M2
+    f_K1, u_K1 = _node('K1', args)
+    if kind == 'MK3':
+        return f_M2 * f_K1, u_M2 + u_K1
+    if kind == '2MK3':
+        return f_M2**2 * f_K1, 2 * u_M2 - u_K1
+    raise ValueError('Unknown node factor formula {}'.format(kind))
+
+
+def read_harmonic_file(source):
+    """ Read a harmonic constituent file for one station.
+
+    The format mirrors the NOAA text files: header lines 'Key: value', a
+    blank line, a line of column names, then one row per constituent. Required
+    header keys are Stationid and Z0 (mean sea level above the chart datum,
+    in the units of the amplitudes, which should be feet); Datum and Units
+    are informational. Phases must be Greenwich phase lags (NOAA 'GMT'
+    phases), in degrees. Columns Name, Amplitude and Phase are required, in
+    any order; other columns (e.g. Speed) are ignored. Example:
+
+        Stationid: 9413450
+        Datum: MLLW
+        Units: feet
+        Z0: 2.80
+
+        Name  Amplitude  Phase
+        M2    1.623      181.3
+        K1    1.181      219.6
+
+    Args:
+        source: a path, '-' for standard input, or a binary file object;
+                plain, gzip or zip content (see tides.open_noaa_source)
+
+    Returns:
+        metadata, constituents
+        metadata (dict): header values, stripped strings
+        constituents: pandas DataFrame indexed by upper-case constituent
+            name, with float columns 'amplitude' and 'phase'
+    """
+    source_name = _source_name(source)
+    metadata = {}
+    rows = []
+    with open_noaa_source(source) as file:
+        for line in file:
+            if line.isspace():
+                break
+            k, _, v = line.partition(':')
+            metadata[k.strip()] = v.strip()
+        columns = [c.lower() for c in file.readline().split()]
+        for line in file:
+            if line.strip():
+                rows.append(line.split())
+
+    for key in ['Stationid', 'Z0']:
+        if not metadata.get(key):
+            raise ValueError('In Tides, read_harmonic_file found no {} in \
+the header of {}.'.format(key, source_name))
+    for column in ['name', 'amplitude', 'phase']:
+        if column not in columns:
+            raise ValueError('In Tides, read_harmonic_file found no {} \
+column in {}.'.format(column.title(), source_name))
+    table = pd.DataFrame([row[:len(columns)] for row in rows],
+                         columns = columns)
+    names = [name.upper() for name in table['name']]
+    unknown = [name for name in names if name not in CONSTITUENTS]
+    if unknown:
+        raise ValueError('In Tides, read_harmonic_file does not know the \
+constituents {} in {}.'.format(', '.join(unknown), source_name))
+    constituents = pd.DataFrame({'amplitude': table['amplitude'].astype(float),
+                                 'phase': table['phase'].astype(float)},
+                                columns = ['amplitude', 'phase'])
+    constituents.index = pd.Index(names, name = 'name')
+    return metadata, constituents
+
+
+def predict_heights(constituents, z0, times):
+    """ Predict tide heights from harmonic constituents:
+    height = z0 + sum over constituents of f * A * cos(V + u - G)
+
+    Args:
+        constituents: DataFrame as returned by `read_harmonic_file`
+        z0 (float): mean sea level above the datum
+        times: 1D array of int64 nanoseconds since the epoch, UTC
+
+    Returns:
+        a float array of heights, same length as times.
+
+    Example:
+    >>> m2 = pd.DataFrame({'amplitude': [1.], 'phase': [0.]}, index=['M2'])
+    >>> times = np.array([0, 6 * 3600 * 10**9, 12 * 3600 * 10**9])
+    >>> np.round(predict_heights(m2, 3., times), 3)
+    array([2.068, 3.9  , 2.141])
+    """
+    args = astronomical_arguments(times)
+    heights = np.full(len(args['T']), float(z0))
+    for name, row in constituents.iterrows():
+        coefs, node = CONSTITUENTS[name]
+        V = (coefs[0] * args['T'] + coefs[1] * args['s'] +
+             coefs[2] * args['h'] + coefs[3] * args['p'] +
+             coefs[4] * args['p1'] + coefs[5])
+        f, u = _node(node, args)
+        heights += f * row['amplitude'] * np.cos((V + u - row['phase']) * D2R)
+    return heights
+
+
+def find_extremes(times, heights):
+    """ Find the highs and lows of a sampled tide curve. Each local extreme
+    of the samples is refined with the parabola through it and its two
+    neighbours.
+
+    Args:
+        times: 1D array of evenly spaced int64 times (e.g. nanoseconds)
+        heights: 1D float array, same length
+
+    Returns:
+        extreme_times, extreme_heights, is_high: int64, float and Boolean
+        arrays, in time order.
+
+    Example:
+    >>> t = np.arange(0, 100, 10)
+    >>> find_extremes(t, -(t - 42.)**2)
+    (array([42]), array([0.]), array([ True]))
+    """
+    times = np.asarray(times, dtype=np.int64)
+    y = np.asarray(heights, dtype=float)
+    d = np.diff(y)
+    # sample i is an extreme if the slope changes sign around it
+    i = np.flatnonzero(((d[:-1] > 0) & (d[1:] <= 0)) |
+                       ((d[:-1] < 0) & (d[1:] >= 0))) + 1
+    y0, y1, y2 = y[i - 1], y[i], y[i + 1]
+    curvature = y0 - 2 * y1 + y2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        offset = np.where(curvature != 0, 0.5 * (y0 - y2) / curvature, 0.)
+    step = times[1] - times[0]
+    extreme_times = times[i] + np.round(offset * step).astype(np.int64)
+    extreme_heights = y1 - 0.25 * (y0 - y2) * offset
+    return extreme_times, extreme_heights, curvature < 0
+
+
+def predict_extremes(constituents, z0, start, stop, step='6min'):
+    """ Predict the high and low tides between two times.
+
+    Args:
+        constituents, z0: as for `predict_heights`
+        start, stop: anything pandas.Timestamp accepts; naive times are UTC
+    Optional:
+        step: the sampling step used to locate extremes (default 6 minutes)
+
+    Returns:
+        a pandas DataFrame indexed by UTC time (named 'TimeIndex'), with
+        columns 'ft' (height) and 'High/Low' ('H' or 'L'), in the layout of
+        `Tides.raw_tides`.
+    """
+    bounds = pd.DatetimeIndex([pd.Timestamp(start), pd.Timestamp(stop)])
+    if bounds.tz is None:
+        bounds = bounds.tz_localize('UTC')
+    ns = bounds.tz_convert('UTC').values.astype('datetime64[ns]').astype(
+                                                                     np.int64)
+    step_ns = pd.Timedelta(step).value
+    # one extra step on each side, so extremes at start/stop are found
+    times = np.arange(ns[0] - step_ns, ns[1] + 2 * step_ns, step_ns)
+    ext_times, ext_heights, is_high = find_extremes(
+        times, predict_heights(constituents, z0, times))
+    keep = (ext_times >= ns[0]) & (ext_times <= ns[1])
+    index = pd.DatetimeIndex(ext_times[keep].astype('datetime64[ns]'),
+                             name = 'TimeIndex').tz_localize('UTC')
+    return pd.DataFrame({'ft': ext_heights[keep],
+                         'High/Low': np.where(is_high[keep], 'H', 'L')},
+                        index = index, columns = ['ft', 'High/Low'])
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Module to find where sampled curves cross levels, and the time intervals they
+spend above them: the rise and set times of astro.py and the tide windows of
+tides.py. It needs only numpy, so that neither module loads the other.
+"""
+
+import numpy as np
+
+
+def linear_fraction(v1, v2, level):
+    """Where a straight line from v1 to v2 crosses `level`, as a fraction of
+    the way from v1 to v2 (the default `fraction` of `level_crossings`)."""
+    return (level - v1) / (v2 - v1)
+
+
+def _crossings(times, values, levels, fraction):
+    """Crossings of each of `levels` (1D array) in one pass over the samples.
+    Returns k, crossings, up, above: the level index and time of each
+    crossing, sorted by level then time, whether it is upward, and the
+    levels x samples array of which samples are above which levels."""
+    with np.errstate(invalid='ignore'):
+        above = values > levels[:, np.newaxis]
+    # crossing of level k between samples i and i+1
+    k, i = np.nonzero(above[:, 1:] != above[:, :-1])
+    v1, v2 = values[i], values[i + 1]
+    known = np.isfinite(v1) & np.isfinite(v2)
+    frac = np.empty(len(i))
+    frac[known] = fraction(v1[known], v2[known], levels[k][known])
+    up = above[k, i + 1]
+    frac[~known] = np.where(up[~known], 1., 0.)   # at the sample above
+    crossings = times[i] + np.round(frac * (times[i + 1] - times[i])
+                                    ).astype(np.int64)
+    return k, crossings, up, above
+
+
+def level_crossings(times, values, level, fraction = None):
+    """Return the times at which a sampled curve crosses a level upward and
+    downward, by linear interpolation between the samples on either side
+    (or by `fraction`). NaN samples count as below the level: a crossing
+    next to one is at the sample on the other side, where the curve stops
+    (or starts) being known above the level.
+
+    Arguments:
+        times (1D array of int64): increasing sample times, e.g. nanoseconds
+        values (1D array of floats): sampled values
+        level (float): the level
+
+    Optional:
+        fraction: a function of the arrays v1, v2 (the values on either side
+            of each crossing) and level (the level crossed), returning where
+            the curve crosses between the two samples, as a fraction (0 to 1)
+            of the time between them. The default is `linear_fraction`.
+
+    Returns:
+        ups, downs: int64 arrays of crossing times, in the units of `times`
+
+    Example:
+    >>> level_crossings(np.array([0, 10, 20, 30, 40]),
+    ...                 np.array([-1., 1., 3., -1., 1.]), 0.)
+    (array([ 5, 35]), array([28]))
+    >>> level_crossings(np.array([0, 10, 20, 30]),
+    ...                 np.array([np.nan, 1., 3., np.nan]), 0.)
+    (array([10]), array([20]))
+    """
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    _, crossings, up, _ = _crossings(times, values, np.array([float(level)]),
+                                     fraction or linear_fraction)
+    return crossings[up], crossings[~up]
+
+
+def intervals_above_levels(times, values, levels, fraction = None):
+    """Return the time intervals during which a sampled curve is above each
+    of several levels, with the crossings of all levels found in one pass
+    (see `level_crossings`).
+
+    Arguments:
+        times (1D array of int64): increasing sample times, e.g. nanoseconds
+        values (1D array of floats): sampled values; NaN counts as not above
+        levels (float or 1D array of floats): the levels to compare against
+        fraction: as for `level_crossings`
+
+    Returns:
+        a list with one (starts, stops) pair of int64 arrays per level, in the
+        units of `times`. An interval that is open at either end of the
+        samples starts/stops at the first/last sample time.
+
+    Example:
+    >>> intervals_above_levels(np.array([0, 10, 20, 30, 40]),
+    ...                        np.array([-1., 1., 3., -1., 1.]), [0., 2.])
+    [(array([ 5, 35]), array([28, 40])), (array([15]), array([22]))]
+    """
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    levels = np.atleast_1d(np.asarray(levels, dtype=float))
+    k, crossings, _, above = _crossings(times, values, levels,
+                                        fraction or linear_fraction)
+    per_level = np.split(crossings, np.cumsum(np.bincount(
+                         k, minlength=len(levels)))[:-1])
+    starts_above = above[:, 0] if len(times) else np.zeros(len(levels), bool)
+    intervals = []
+    # crossings alternate: open intervals lack their up or their down
+    for is_above, bounds in zip(starts_above, per_level):
+        if is_above:
+            bounds = np.concatenate([times[:1], bounds])
+        if len(bounds) % 2:
+            bounds = np.concatenate([bounds, times[-1:]])
+        intervals.append((bounds[0::2], bounds[1::2]))
+    return intervals
+
+
+def intervals_above(times, values, level, fraction = None):
+    """Return the time intervals during which a sampled curve is above a
+    level: `intervals_above_levels` for a single level.
+
+    Returns:
+        starts, stops: int64 arrays of interval start and stop times, in the
+            units of `times`.
+
+    Example:
+    >>> intervals_above(np.array([0, 10, 20, 30, 40]),
+    ...                 np.array([-1., 1., 3., -1., 1.]), 0.)
+    (array([ 5, 35]), array([28, 40]))
+    """
+    return intervals_above_levels(times, values, [level], fraction)[0]
+
+
+def _secant(func, date, delta = 1 / 1440., tolerance = 1 / 864000.,
+            iterations = 8):
+    """Refine a time in days (e.g. an ephem date) at which func(date) == 0,
+    starting from `date` and `date + delta` (default a minute), with the
+    secant method, to within `tolerance` (default a tenth of a second)."""
+    d0, d1 = date, date + delta
+    f0, f1 = func(d0), func(d1)
+    for _ in range(iterations):
+        if f1 == f0:
+            break
+        d0, d1, f0 = d1, d1 - f1 * (d1 - d0) / (f1 - f0), f1
+        if abs(d1 - d0) < tolerance:
+            break
+        f1 = func(d1)
+    return d1
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -5,13 +5,25 @@ Search for `&**&` to find code segments that assume a certain format for the
 NOAA text file input. Last updated 7/24/2015 by Sara Hendrix.
 """
 
+import collections
+import contextlib
+import gzip
+import hashlib
+import io
 import itertools
+import json
 import numpy as np
 import math
+import os
 import pandas as pd
 import pkgutil
+import sys
+import zipfile
 from io import BytesIO
 
+from cache import DiskCache, content_key
+from intervals import intervals_above_levels
+
 def pairwise(iterable):
     "s -> (s0,s1), (s1,s2), (s2, s3), ..."
     a, b = itertools.tee(iterable)
@@ -84,6 +96,112 @@ def sine_interp(height1, height2, resolution, remove_end=False):
         return y
 
 
+@contextlib.contextmanager
+def open_noaa_source(source):
+    """ Context manager that opens a NOAA Annual Tide Prediction text file
+    source as a text stream, ready to be read line by line.
+
+    Args:
+        source: any of
+            - a path (str) to a NOAA text file, or '-' for standard input
+            - an open binary file object, e.g. io.BytesIO or sys.stdin.buffer
+        The content may be plain text, gzip compressed, or a zip archive
+        containing a single NOAA text file; compression is detected from
+        the first bytes of the content, not from a file extension.
+
+    Yields:
+        a text stream (universal newlines) over the uncompressed content.
+        Files opened here are closed on exit; file objects passed in by the
+        caller are left open.
+    """
+    to_close = []     # opened here, closed on exit
+    to_detach = []    # wrappers around the caller's stream, left open
+    try:
+        if isinstance(source, str):
+            if source == '-':
+                binary = sys.stdin.buffer
+            else:
+                binary = open(source, 'rb')
+                to_close.append(binary)
+        else:
+            binary = source
+        if not hasattr(binary, 'peek'):
+            binary = io.BufferedReader(binary)
+            to_detach.append(binary)
+        magic = binary.peek(4)[:4]
+        if magic[:2] == b'\x1f\x8b':
+            binary = gzip.GzipFile(fileobj=binary, mode='rb')
+            to_close.append(binary)
+        elif magic == b'PK\x03\x04':
+            if not binary.seekable():
+                binary = BytesIO(binary.read())
+            archive = zipfile.ZipFile(binary)
+            to_close.append(archive)
+            members = [m for m in archive.namelist() if not m.endswith('/')]
+            if len(members) != 1:
+                raise ValueError('In Tides, open_noaa_source expected a zip \
+archive containing exactly one NOAA text file, found {}.'.format(members))
+            binary = archive.open(members[0])
+            to_close.append(binary)
+        text = io.TextIOWrapper(binary, encoding='latin-1', newline=None)
+        to_detach.append(text)
+        yield text
+    finally:
+        for f in reversed(to_detach):
+            f.detach()
+        for f in reversed(to_close):
+            f.close()
+
+
+def _source_name(source):
+    """Return a printable name for a NOAA file source, for error messages."""
+    if isinstance(source, str):
+        return source
+    return getattr(source, 'name', repr(source))
+
+
+def _read_header_lines(file, source_name):
+    """ Read and check the header of a NOAA Annual Tide Prediction text
+    stream, leaving the stream positioned at the first row of the main data
+    table. See `read_noaa_header` for the returned values.
+    &**& heavily dependent on the NOAA file format.
+    """
+    metadata = {}
+    for line in file:
+        if line.isspace():
+                break
+        elif line.find(': ') >= 0:
+            k, v = line.split(': ', 1)
+        else:
+            k = line
+            v = ''
+        metadata[k] = v
+    column_names = file.readline()
+    
+    def _check_that(Boolean_valued_statement):
+        """If `Boolean_valued_statement` is False, raise a detailed error."""
+        if not Boolean_valued_statement:
+            error_message = (
+'In Tides, read_noaa_header found a problem in {}.\nThis file failed a header \
+format check. (`_check_that` in Traceback above.)\nSee example_noaa_file.TXT \
+for an example of the expected file format.'.format(source_name))
+            raise ValueError(error_message)
+    
+    _check_that(metadata.get('NOAA/NOS/CO-OPS\n') == '')
+    _check_that(metadata.get('Product Type', '').strip() ==
+                'Annual Tide Prediction')
+    _check_that(metadata.get('Interval Type', '').strip() ==
+                'High/Low Tide Predictions')
+    _check_that(metadata.get('Time Zone', '').find('LST') >= 0)
+    _check_that(metadata.get('Stationid'))
+    expected_column_names = ['Date', 'Day', 'Time', 'Pred(Ft)',
+                             'Pred(cm)', 'High/Low']
+    col_names = column_names.split()
+    _check_that(col_names == expected_column_names)
+
+    return metadata, column_names
+
+
 def read_noaa_header(filename):
     """ Return the metadata in the header of a NOAA Annual Tide Prediction
     text file, plus the line of column names. Assumes header is separated
@@ -95,7 +213,9 @@ def read_noaa_header(filename):
 
     Args:
         filename (str): the name of a NOAA Annual Tide Prediction text file
-                        in the current interpreter directory, or path to file
+                        in the current interpreter directory, or path to file.
+                        Any other source accepted by `open_noaa_source` also
+                        works (binary file objects, gzip or zip content).
     
     Returns:
       metadata, column_header
@@ -115,39 +235,340 @@ def read_noaa_header(filename):
     ['Date', 'Day', 'Time', 'Pred(Ft)', 'Pred(cm)', 'High/Low']
 
     """
-    metadata = {}
-    with open(filename, 'r') as file:
+    with open_noaa_source(filename) as file:
+        return _read_header_lines(file, _source_name(filename))
+
+
+def read_noaa_file(source):
+    """ Read the header and the high/low table of a NOAA Annual Tide
+    Prediction text file in a single pass.
+
+    &**& heavily dependent on the NOAA file format. Data rows look like
+         '2015/01/01  Thu  12:27 AM  2.0  61  L' (whitespace separated).
+
+    Args:
+        source: a path, '-' for standard input, or a binary file object.
+                Plain, gzip or zip content (see `open_noaa_source`).
+
+    Returns:
+      metadata, column_names, raw_tides
+        metadata, column_names: as returned by `read_noaa_header`
+        raw_tides: a pandas DataFrame with timezone-naive local time index
+                   named 'TimeIndex', and columns 'ft' (float), 'cm' (float)
+                   and 'High/Low' (string, 'H' or 'L'), one row per high/low.
+
+    Dates are parsed with a fixed-format parser (no pandas date inference):
+    the 'YYYY/MM/DD' field becomes a numpy datetime64 day and the 'HH:MM AM'
+    fields are added as whole minutes.
+
+    Examples:
+    >>> meta, cols, raw = read_noaa_file('example_noaa_file.TXT')
+    >>> print(raw.head(2))
+                          ft     cm High/Low
+    TimeIndex                               
+    2014-12-31 06:11:00  5.7  174.0        H
+    2014-12-31 13:26:00 -0.1   -3.0        L
+    """
+    source_name = _source_name(source)
+    days, clocks, meridiems, ft, cm, high_low = [], [], [], [], [], []
+    with open_noaa_source(source) as file:
+        metadata, column_names = _read_header_lines(file, source_name)
         for line in file:
-            if line.isspace():
-                    break
-            elif line.find(': ') >= 0:
-                k, v = line.split(': ')
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) != 7:
+                raise ValueError('In Tides, read_noaa_file could not parse \
+the line {!r} of {}.'.format(line, source_name))
+            days.append(fields[0].replace('/', '-'))
+            clocks.append(fields[2])
+            meridiems.append(fields[3])
+            ft.append(fields[4])
+            cm.append(fields[5])
+            high_low.append(fields[6])
+
+    days = np.array(days, dtype='datetime64[D]')
+    clocks = np.array(clocks)
+    hours = np.array([c[:-3] for c in clocks], dtype=int) % 12
+    minutes = np.array([c[-2:] for c in clocks], dtype=int)
+    hours += np.where(np.array(meridiems) == 'PM', 12, 0)
+    times = days + (hours * 60 + minutes).astype('timedelta64[m]')
+
+    raw_tides = pd.DataFrame({'ft': np.array(ft, dtype=float),
+                              'cm': np.array(cm, dtype=float),
+                              'High/Low': high_low},
+                             index=pd.DatetimeIndex(times, name='TimeIndex'),
+                             columns=['ft', 'cm', 'High/Low'])
+    return metadata, column_names, raw_tides
+
+
+# Parsed NOAA files, most recently used last. Keys identify file content, so
+# calendars sharing a year (e.g. July-June products) parse that file once.
+_parsed_noaa_files = collections.OrderedDict()
+_PARSED_NOAA_FILES_MAX = 32
+
+
+def read_source_bytes(source):
+    """Return the whole content of a NOAA file source (a path, '-' for
+    standard input, or a binary file object) as bytes, still compressed if
+    it was."""
+    if isinstance(source, str):
+        if source == '-':
+            return sys.stdin.buffer.read()
+        with open(source, 'rb') as f:
+            return f.read()
+    return source.read()
+
+
+def read_noaa_file_cached(source):
+    """ Like `read_noaa_file`, but remembers the result for the life of the
+    process. A path is identified by its absolute path, modification time
+    and size; any other source is read into memory and identified by the
+    SHA-1 of its bytes. The most recently used parsed files are kept.
+
+    Returns metadata, column_names, raw_tides as `read_noaa_file` does;
+    raw_tides is a copy, so callers are free to modify it.
+    """
+    if isinstance(source, str) and source != '-':
+        st = os.stat(source)
+        key = (os.path.abspath(source), st.st_mtime, st.st_size)
+    else:
+        content = read_source_bytes(source)
+        key = hashlib.sha1(content).hexdigest()
+        source = BytesIO(content)
+
+    if key in _parsed_noaa_files:
+        _parsed_noaa_files.move_to_end(key)
+    else:
+        _parsed_noaa_files[key] = read_noaa_file(source)
+        while len(_parsed_noaa_files) > _PARSED_NOAA_FILES_MAX:
+            _parsed_noaa_files.popitem(last=False)
+    metadata, column_names, raw_tides = _parsed_noaa_files[key]
+    return dict(metadata), column_names, raw_tides.copy()
+
+
+def merge_noaa_tables(raw_tables):
+    """ Merge the high/low tables of several NOAA annual files for the same
+    station into one continuous table, in chronological order. Annual files
+    overlap (e.g. a 2015 file starts on 2014/12/31), so rows repeated with
+    the same timestamp are kept only once.
+
+    Args:
+        raw_tables: a sequence of DataFrames as returned by `read_noaa_file`
+
+    Returns:
+        a single DataFrame with sorted, unique timestamps.
+    """
+    merged = pd.concat(raw_tables)
+    merged = merged.sort_index(kind='mergesort')
+    return merged[~merged.index.duplicated(keep='first')]
+
+
+class StationIndex:
+    """Compact, array-backed table of station_info.csv, with a hash map from
+    station ID to row number. Build it once and reuse it for every lookup;
+    `station_index()` returns the process-wide instance.
+
+    station_info.csv has the following columns:
+    StationID, StationName, State, Latitude, Longitude, StationType, Timezone
+
+    Attributes (one numpy array element per station, in CSV order):
+        ids, names, states, st_types, timezones: unicode string arrays
+        latitudes, longitudes: float arrays (decimal degrees)
+        csv_sha1 (str): SHA-1 of the CSV content the index was built from
+        csv_mtime (float): modification time of that CSV, if known
+    """
+    _text_fields = ['ids', 'names', 'states', 'st_types', 'timezones']
+    _float_fields = ['latitudes', 'longitudes']
+
+    def __init__(self, arrays, csv_sha1, csv_mtime=None):
+        for field in self._text_fields:
+            setattr(self, field, np.asarray(arrays[field], dtype=str))
+        for field in self._float_fields:
+            setattr(self, field, np.asarray(arrays[field], dtype=float))
+        self.csv_sha1 = csv_sha1
+        self.csv_mtime = csv_mtime
+        self._rows = dict((st_id, row) for row, st_id in enumerate(self.ids))
+
+    @classmethod
+    def from_csv_bytes(cls, content, csv_mtime=None):
+        """Build the index from the bytes of a station_info.csv file."""
+        table = pd.read_csv(BytesIO(content), dtype=str, keep_default_na=False)
+        arrays = {'ids': table['StationID'],
+                  'names': table['StationName'],
+                  'states': table['State'],
+                  'latitudes': table['Latitude'].astype(float),
+                  'longitudes': table['Longitude'].astype(float),
+                  'st_types': table['StationType'],
+                  'timezones': table['Timezone']}
+        return cls(arrays, hashlib.sha1(content).hexdigest(), csv_mtime)
+
+    @classmethod
+    def load(cls, filename):
+        """Load an index saved with `save`."""
+        with np.load(filename) as saved:
+            arrays = dict((k, saved[k]) for k in
+                          cls._text_fields + cls._float_fields)
+            csv_sha1 = str(saved['csv_sha1'])
+            csv_mtime = float(saved['csv_mtime'])
+        return cls(arrays, csv_sha1, csv_mtime)
+
+    def save(self, filename):
+        """Save the index as an uncompressed .npz file (no pickled objects)."""
+        arrays = dict((k, getattr(self, k)) for k in
+                      self._text_fields + self._float_fields)
+        np.savez(filename, csv_sha1=np.array(self.csv_sha1),
+                 csv_mtime=np.array(self.csv_mtime or 0.), **arrays)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, StationID):
+        return StationID in self._rows
+
+    def row(self, StationID):
+        """Row number of StationID; raises KeyError if it is not present."""
+        return self._rows[StationID]
+
+    def _spatial_index(self):
+        """Unit vectors of all stations on the sphere, plus a KD-tree over
+        them when scipy is available. Built on first use."""
+        if getattr(self, '_xyz', None) is None:
+            lat = np.radians(self.latitudes)
+            lon = np.radians(self.longitudes)
+            self._xyz = np.column_stack([np.cos(lat) * np.cos(lon),
+                                         np.cos(lat) * np.sin(lon),
+                                         np.sin(lat)])
+            try:
+                from scipy.spatial import cKDTree
+                self._tree = cKDTree(self._xyz)
+            except ImportError:
+                self._tree = None   # vectorized scan of self._xyz instead
+        return self._xyz, self._tree
+
+    def nearest(self, latitude, longitude, k=1, radius_km=None):
+        """ Find the stations nearest to a location.
+
+        Distances are great-circle distances on a spherical Earth, computed
+        from straight-line (chord) distances between unit vectors, which have
+        the same ordering. Queries use a KD-tree (scipy.spatial.cKDTree) when
+        scipy is installed, otherwise a vectorized scan of all stations.
+
+        Args:
+            latitude, longitude (floats): decimal degrees
+        Optional:
+            k (int or None, default 1): the number of stations wanted. None
+                means no limit (use with radius_km).
+            radius_km (float or None): only stations within this distance.
+
+        Returns:
+            rows, distances_km: int and float arrays, nearest first.
+        """
+        xyz, tree = self._spatial_index()
+        lat, lon = math.radians(float(latitude)), math.radians(float(longitude))
+        point = np.array([math.cos(lat) * math.cos(lon),
+                          math.cos(lat) * math.sin(lon), math.sin(lat)])
+        if radius_km is None:
+            max_chord = np.inf
+        else:
+            angle = min(float(radius_km) / EARTH_RADIUS_KM, math.pi)
+            max_chord = 2. * math.sin(angle / 2.)
+        if k is None:
+            k = len(self)
+        k = min(int(k), len(self))
+
+        if tree is not None:
+            if radius_km is None:
+                chords, rows = tree.query(point, k=k)
             else:
-                k = line
-                v = ''
-            metadata[k] = v
-        column_names = file.readline()
-    
-    def _check_that(Boolean_valued_statement):
-        """If `Boolean_valued_statement` is False, raise a detailed error."""
-        if not Boolean_valued_statement:
+                rows = np.array(tree.query_ball_point(point, max_chord),
+                                dtype=int)
+                chords = np.sqrt(((xyz[rows] - point) ** 2).sum(axis=1))
+            chords, rows = np.atleast_1d(chords), np.atleast_1d(rows)
+        else:
+            all_chords = np.sqrt(((xyz - point) ** 2).sum(axis=1))
+            rows = np.flatnonzero(all_chords <= max_chord)
+            if k < len(rows):
+                rows = rows[np.argpartition(all_chords[rows], k - 1)[:k]]
+            chords = all_chords[rows]
+
+        order = np.argsort(chords, kind='mergesort')[:k]
+        rows, chords = rows[order], chords[order]
+        keep = chords <= max_chord
+        rows, chords = rows[keep], chords[keep]
+        distances = 2. * EARTH_RADIUS_KM * np.arcsin(np.minimum(chords / 2., 1.))
+        return rows, distances
+
+    def lookup(self, StationID):
+        """Return the station information for StationID as a dict, in the
+        format of `lookup_station_info`. Raises KeyError if not present."""
+        row = self._rows[StationID]
+        info = {}
+        info['st_id']     = StationID
+        info['name']      = self.names[row]
+        info['state']     = self.states[row]
+        info['latitude']  = self.latitudes[row]
+        info['longitude'] = self.longitudes[row]
+        info['st_type']   = self.st_types[row]
+        info['timezone']  = self.timezones[row]
+        return info
+
+
+_station_index = None
+EARTH_RADIUS_KM = 6371.0088   # mean Earth radius
+
+
+def station_index(persist=False):
+    """ Return the process-wide StationIndex for station_info.csv, building
+    it on first use.
+
+    A prebuilt binary copy, station_info.npz next to station_info.csv, is
+    used when present and still matching the CSV: same modification time,
+    or else same SHA-1 of the content. Otherwise the index is rebuilt from
+    the CSV.
+
+    Optional:
+        persist (Boolean, default False): if True, (re)write station_info.npz
+            whenever the index had to be rebuilt from the CSV.
+    """
+    global _station_index
+    if _station_index is not None:
+        return _station_index
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    csv_path = os.path.join(here, 'station_info.csv')
+    npz_path = os.path.join(here, 'station_info.npz')
+    csv_mtime = os.path.getmtime(csv_path) if os.path.isfile(csv_path) else None
+    index = None
+    if csv_mtime is not None and os.path.isfile(npz_path):
+        try:
+            index = StationIndex.load(npz_path)
+        except Exception:
+            index = None   # unreadable prebuilt file, rebuild below
+        if index is not None and index.csv_mtime != csv_mtime:
+            with open(csv_path, 'rb') as f:
+                if hashlib.sha1(f.read()).hexdigest() != index.csv_sha1:
+                    index = None
+            if index is not None:
+                # only touched, content unchanged: remember the new mtime
+                index.csv_mtime = csv_mtime
+                if persist:
+                    index.save(npz_path)
+
+    if index is None:
+        try:
+            lookup = pkgutil.get_data('tides', 'station_info.csv')
+        except Exception as e:
             error_message = (
-'In Tides, read_noaa_header found a problem in {}.\nThis file failed a header \
-format check. (`_check_that` in Traceback above.)\nSee example_noaa_file.TXT \
-for an example of the expected file format.'.format(filename))
-            raise ValueError(error_message)
-    
-    _check_that(metadata['NOAA/NOS/CO-OPS\n'] == '')
-    _check_that(metadata['Product Type'].strip() == 'Annual Tide Prediction')
-    _check_that(metadata['Interval Type'].strip() == 'High/Low Tide Predictions')
-    _check_that(metadata['Time Zone'].find('LST') >= 0)
-    _check_that(metadata['Stationid'])
-    expected_column_names = ['Date', 'Day', 'Time', 'Pred(Ft)',
-                             'Pred(cm)', 'High/Low']
-    col_names = column_names.split()
-    _check_that(col_names == expected_column_names)
+'In Tides, lookup_station_info could not find its lookup file, \
+station_info.csv. Error: {}'.format(e))
+            raise IOError(error_message)
+        index = StationIndex.from_csv_bytes(lookup, csv_mtime)
+        if persist and csv_mtime is not None:
+            index.save(npz_path)
 
-    return metadata, column_names
+    _station_index = index
+    return _station_index
 
 
 def lookup_station_info(StationID):
@@ -157,6 +578,8 @@ def lookup_station_info(StationID):
     station_info.csv has the following columns:
     StationID, StationName, State, Latitude, Longitude, StationType, Timezone
 
+    The CSV is read only once per process, see `station_index`.
+
     %**% This function would need to be changed if the station is not a NOAA
     tide prediction station. For any new stations not currently present in
     station_info.csv, the function will work properly if the new station is
@@ -177,36 +600,211 @@ def lookup_station_info(StationID):
     >>> info['timezone']
     'US/Central'
 """
+    index = station_index()
     try:
-        lookup = pkgutil.get_data('tides', 'station_info.csv')
-    except Exception as e:
-        error_message = (
-'In Tides, lookup_station_info could not find its lookup file, \
-station_info.csv. Error: {}'.format(e))
-        raise IOError(error_message)
-
-    all_data = pd.read_csv(BytesIO(lookup), index_col=0)
-    try:
-        station_data = all_data.loc[StationID]
+        info = index.lookup(StationID)
     except Exception as e:
         error_message = (
 'In Tides, lookup_station_info could not find Station ID {0} in its lookup \
 dataset. Error: {1}... Make sure Station ID {0} is present in \
 station_info.csv.'.format(StationID, e))
         raise ValueError(error_message)
-            
-    info = {}
-    info['st_id']     = StationID
-    info['name']      = station_data['StationName']
-    info['state']     = station_data['State']
-    info['latitude']  = station_data['Latitude']
-    info['longitude'] = station_data['Longitude']
-    info['st_type']   = station_data['StationType']
-    info['timezone']  = station_data['Timezone']
     return info
 
 
-def build_all_tides(raw_tides, resolution, use_column, extend_ends=False):
+def nearest_stations(latitude, longitude, k=1, radius_km=None):
+    """ Return the NOAA tide prediction stations in station_info.csv nearest
+    to a location, nearest first.
+
+    Args:
+        latitude, longitude (floats): decimal degrees
+    Optional:
+        k (int or None, default 1): the number of stations wanted, or None
+            for all stations within radius_km.
+        radius_km (float or None): only stations within this great-circle
+            distance, in kilometers.
+
+    Returns:
+        a list of dicts in the format of `lookup_station_info`, each with an
+        extra key 'distance_km'.
+
+    Examples:
+    >>> near = nearest_stations(36.96, -122.02, k=2)
+    >>> [(s['st_id'], s['name'], round(s['distance_km'], 1)) for s in near]
+    [('9413745', 'Santa Cruz, Monterey Bay', 0.3), ('9413663', 'Elkhorn Slough Railroad Bridge', 26.2)]
+    """
+    index = station_index()
+    rows, distances = index.nearest(latitude, longitude, k, radius_km)
+    stations = []
+    for row, distance in zip(rows, distances):
+        info = index.lookup(index.ids[row])
+        info['distance_km'] = distance
+        stations.append(info)
+    return stations
+
+
+def parse_height_offsets(values):
+    """ Parse subordinate station height offsets.
+
+    Args:
+        values: an iterable of height offsets. Numbers and strings starting
+            with '*' (the NOAA header style, e.g. '* 0.97') are ratios;
+            other strings starting with '+' or '-' are offsets in feet.
+
+    Returns:
+        ratios, additions: float arrays such that the corrected height is
+        height * ratio + addition.
+
+    Examples:
+    >>> parse_height_offsets(['*0.99', ' * 0.97', 1.1, '+0.2', '-0.3'])
+    (array([0.99, 0.97, 1.1 , 1.  , 1.  ]), array([ 0. ,  0. ,  0. ,  0.2, -0.3]))
+    """
+    ratios, additions = [], []
+    for value in values:
+        text = str(value).strip()
+        if text[:1] in '+-' and text:
+            ratios.append(1.)
+            additions.append(float(text))
+        else:
+            ratios.append(float(text.strip('*').strip()))
+            additions.append(0.)
+    return np.array(ratios), np.array(additions)
+
+
+def sine_interp_array(heights1, heights2, resolution):
+    """ Vectorized `sine_interp`: interpolate a half sine wave between each
+    pair of heights in one pass.
+
+    Args:
+        heights1 (array-like of floats): the starting heights
+        heights2 (array-like of floats): the ending heights, same length as
+                                         heights1
+        resolution (int): the resolution desired for every interval (number
+                          of columns in the returned array), must be >2
+
+    Returns:
+        y: a 2D array of floats with shape (len(heights1), resolution).
+        Row i is identical to `sine_interp(heights1[i], heights2[i],
+        resolution)`.
+
+    Examples:
+    >>> yy = sine_interp_array([-1.2, -6.2], [-6.2, -1.2], 5)
+    >>> print(yy)
+    [[-1.2        -1.93223305 -3.7        -5.46776695 -6.2       ]
+     [-6.2        -5.46776695 -3.7        -1.93223305 -1.2       ]]
+    """
+    h1 = np.asarray(heights1, dtype=float)
+    h2 = np.asarray(heights2, dtype=float)
+    assert(h1.shape == h2.shape)
+    assert(type(resolution) is int)
+    assert(resolution > 2)
+
+    amp = (np.maximum(h1, h2) - np.minimum(h1, h2)) / 2.  # amplitudes
+    bump = np.maximum(h1, h2) - amp                       # vertical offsets
+    # same x values as sine_interp, picked row by row
+    rising = np.linspace(-math.pi / 2., math.pi / 2., resolution)
+    falling = np.linspace(math.pi / 2., (3. / 2.) * math.pi, resolution)
+    x = np.where((h1 < h2)[:, np.newaxis], rising, falling)
+
+    return amp[:, np.newaxis] * np.sin(x) + bump[:, np.newaxis]
+
+
+def interval_resolutions(durations, heights1, heights2, resolution,
+                         max_step=None, max_error=None):
+    """ Choose the interpolation resolution of each high/low interval.
+
+    Args:
+        durations (array of int64): interval lengths in microseconds
+        heights1, heights2 (arrays of floats): starting and ending heights
+        resolution (integer > 2): used for every interval when neither option
+            below is given; otherwise the largest resolution allowed.
+
+    Optional:
+        max_step: the longest time step wanted between interpolated points,
+            as anything pandas.Timedelta accepts (e.g. '10min').
+        max_error (float): the largest vertical error wanted (same units as
+            the heights) when the interpolated points are joined by straight
+            lines. A half sine of amplitude A sampled every d radians is off
+            by at most A * (1 - cos(d / 2)), halfway between two points.
+        If both are given, the resolution meets both.
+
+    Returns:
+        an int array with one resolution (> 2, <= resolution) per interval.
+
+    Examples:
+    >>> six_hours = 6 * 60 * 60 * 10**6
+    >>> interval_resolutions(np.array([six_hours, 2 * six_hours]),
+    ...                      np.array([5., 5.]), np.array([-1., 4.9]), 100,
+    ...                      max_step='15min')
+    array([25, 49])
+    >>> interval_resolutions(np.array([six_hours, six_hours]),
+    ...                      np.array([5., 5.]), np.array([-1., 4.9]), 100,
+    ...                      max_error=0.01)
+    array([21,  4])
+    """
+    durations = np.asarray(durations)
+    if max_step is None and max_error is None:
+        return np.full(len(durations), resolution, dtype=int)
+
+    points = np.full(len(durations), 3, dtype=int)
+    if max_step is not None:
+        step = pd.Timedelta(max_step).value // 1000   # microseconds
+        points = np.maximum(points, -(-durations // step) + 1)
+    if max_error is not None:
+        amp = np.abs(np.asarray(heights2) - np.asarray(heights1)) / 2.
+        ratio = np.clip(1. - max_error / np.maximum(amp, 1e-12), -1., 1.)
+        # largest allowed angle between points, then points to cover pi
+        max_angle = 2. * np.arccos(ratio)
+        with np.errstate(divide='ignore'):
+            needed = np.ceil(math.pi / max_angle) + 1
+        needed[max_angle <= 0] = resolution
+        points = np.maximum(points, needed.astype(int))
+    return np.clip(points, 3, resolution).astype(int)
+
+
+def sine_interp_ragged(heights1, heights2, resolutions):
+    """ Vectorized `sine_interp` with `remove_end=True`, where every interval
+    has its own resolution.
+
+    Args:
+        heights1, heights2 (arrays of floats): starting and ending heights
+        resolutions (array of ints > 2): resolution of each interval
+
+    Returns:
+        heights, steps
+        heights: 1D float array, the concatenation of
+            sine_interp(heights1[i], heights2[i], resolutions[i], True)
+        steps: 1D int array, same length; the position of each point within
+            its interval (0 at the start of every interval).
+
+    Examples:
+    >>> yy, kk = sine_interp_ragged([-1.2, -6.2], [-6.2, -1.2], [5, 3])
+    >>> print(yy)
+    [-1.2        -1.93223305 -3.7        -5.46776695 -6.2        -3.7       ]
+    >>> print(kk)
+    [0 1 2 3 0 1]
+    """
+    h1 = np.asarray(heights1, dtype=float)
+    h2 = np.asarray(heights2, dtype=float)
+    resolutions = np.asarray(resolutions, dtype=int)
+    assert(np.all(resolutions > 2))
+    counts = resolutions - 1
+    interval = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    steps = np.arange(counts.sum()) - starts[interval]
+
+    amp = (np.maximum(h1, h2) - np.minimum(h1, h2)) / 2.  # amplitudes
+    bump = np.maximum(h1, h2) - amp                       # vertical offsets
+    # the x values np.linspace gives sine_interp, for every interval at once
+    x0 = np.where(h1 < h2, -math.pi / 2., math.pi / 2.)
+    x1 = np.where(h1 < h2, math.pi / 2., (3. / 2.) * math.pi)
+    dx = (x1 - x0) / counts
+    x = steps * dx[interval] + x0[interval]
+    return amp[interval] * np.sin(x) + bump[interval], steps
+
+
+def build_all_tides(raw_tides, resolution, use_column, extend_ends=False,
+                    max_step=None, max_error=None):
     """ Interpolate tide magnitudes and timestamps from given highs/lows.
     
     Args:
@@ -226,88 +824,464 @@ def build_all_tides(raw_tides, resolution, use_column, extend_ends=False):
             an odd visual cut off in the first hours of Jan 1 when raw_tides
             begins after midnight, and also in the last hours of Dec 31 when
             raw_tides ends before midnight.
+        max_step, max_error: choose the resolution of each interval from a
+            target time step and/or a maximum error, with `resolution` as
+            the upper bound. See `interval_resolutions`.
 
     Returns:
         all_tides: a pandas timeseries of sine interpolated tides,
                    with datetime index localized to UTC.
+
+    All intervals are interpolated at once with array operations. Timestamps
+    are whole microseconds, evenly spaced within each interval (the same
+    spacing `np.arange` gives per interval).
     """
     assert(raw_tides.index.tzinfo.zone == 'UTC')    
     assert(type(resolution) is int)
     assert(resolution > 2)
     
-    raw_values = eval('raw_tides.' + use_column)
-    alltides = []
-    tidetimes = []
-    
-    if extend_ends:
-        # interpolate from second tide height to first tide height
-        initial_interps = sine_interp(raw_values[1], raw_values[0],
-                                      resolution, True)
-        alltides.append(initial_interps)
-        # start 7 hours before first tide extreme
-        a = np.datetime64(raw_tides.index[0]) - np.timedelta64(7, 'h')
-        b = np.datetime64(raw_tides.index[0])
-        step = np.timedelta64((b - a) / (resolution - 1))
-        initial_times = np.arange(a, b, step)
-        initial_times = initial_times[:resolution - 1]
-        tidetimes.append(initial_times)
-        
-    
-    for value_a, value_b in pairwise(raw_values):
-        interps = sine_interp(value_a, value_b, resolution, True)
-        assert(len(interps) == (resolution - 1))
-        alltides.append(interps)
-    alltides = np.array(alltides).flatten()
-    # add on the last tide value, left out of the loop
-    alltides = np.append(alltides, raw_values[-1])
-
-    # create datetime index for alltides, with even spacing between each 
-    # subsequent high/low time from the raw_tides datetime index.    
-    for time_a, time_b in pairwise(raw_tides.index):
-        a = np.datetime64(time_a)
-        b = np.datetime64(time_b)
-        step = np.timedelta64((b - a) / (resolution-1))
-        interv = np.arange(a, b, step)
-        # assure proper length of time interval
-        interv = interv[:resolution-1]
-        assert(len(interv) == (resolution - 1))
-        tidetimes.append(interv)
-    tidetimes = np.array(tidetimes, dtype = 'datetime64[us]').flatten()
-    # add on the last datetime, left out of the loop
-    last_one = np.datetime64(raw_tides.index[-1])
-    assert(np.dtype(tidetimes[1]) == np.dtype(last_one))
-    tidetimes = np.append(tidetimes, last_one)
-    
+    raw_values = np.asarray(raw_tides[use_column], dtype=float)
+    # tz-aware index .values are UTC datetime64; work in integer microseconds
+    raw_times = raw_tides.index.values.astype('datetime64[us]').astype(np.int64)
+    seven_hours = np.int64(7 * 60 * 60 * 10**6)
+    ten_seconds = np.int64(10 * 10**6)
+
+    durations = raw_times[1:] - raw_times[:-1]
+    resolutions = interval_resolutions(durations, raw_values[:-1],
+                                       raw_values[1:], resolution,
+                                       max_step, max_error)
+    # interval endpoints are left out, they begin the next interval
+    heights, steps = sine_interp_ragged(raw_values[:-1], raw_values[1:],
+                                        resolutions)
+    # even spacing between each subsequent high/low time
+    spacing = durations // (resolutions - 1)
+    counts = resolutions - 1
+    times = (np.repeat(raw_times[:-1], counts) +
+             steps * np.repeat(spacing, counts))
+    # add on the last tide value and time, left out of the intervals
+    alltides = [heights, raw_values[-1:]]
+    tidetimes = [times, raw_times[-1:]]
+
     if extend_ends:
-        # interpolate from last tide height to next-to-last tide height
-        interps = sine_interp(raw_values[-1], raw_values[-2], resolution, False)
-        alltides = np.append(alltides, interps)
-        # start 10 seconds after last tide extreme
-        a = np.datetime64(raw_tides.index[-1]) + np.timedelta64(10, 's')
-        b = a + np.timedelta64(7, 'h')  # 7 hours later
-        step = np.timedelta64((b - a) / (resolution-1))
-        interv = np.arange(a, b, step)
-        tidetimes = np.append(tidetimes, interv)
+        pad_resolution = int(interval_resolutions(
+            np.array([seven_hours, seven_hours]),
+            raw_values[[1, -1]], raw_values[[0, -2]],
+            resolution, max_step, max_error).max())
+        # interpolate from second tide height to first tide height,
+        # starting 7 hours before first tide extreme
+        pad = sine_interp_array(raw_values[1:2], raw_values[0:1],
+                                pad_resolution)
+        alltides.insert(0, pad[0, :-1])
+        spacing = seven_hours // (pad_resolution - 1)
+        tidetimes.insert(0, raw_times[0] - seven_hours +
+                         np.arange(pad_resolution - 1) * spacing)
+        # interpolate from last tide height to next-to-last tide height,
+        # starting 10 seconds after last tide extreme
+        pad = sine_interp_array(raw_values[-1:], raw_values[-2:-1],
+                                pad_resolution)
+        alltides.append(pad[0])
+        tidetimes.append(raw_times[-1] + ten_seconds +
+                         np.arange(pad_resolution) * spacing)
 
+    alltides = np.concatenate(alltides)
+    tidetimes = np.concatenate(tidetimes).astype('datetime64[us]')
     assert(len(tidetimes)==len(alltides))
     all_tides = pd.Series(alltides,tidetimes)
     all_tides.index = all_tides.index.tz_localize('UTC')
     return all_tides
 
 
+def padded_extremes(raw_tides, use_column):
+    """ Return the high/low times and heights of raw_tides as plain arrays,
+    padded at both ends the way `build_all_tides` does with extend_ends=True:
+    raw_tides[1] is repeated 7 hours before raw_tides[0], and raw_tides[-2]
+    7 hours after raw_tides[-1] (plus the 10 second gap build_all_tides
+    leaves after the last extreme).
+
+    Args:
+        raw_tides: a pandas DataFrame with tz-aware datetime index
+        use_column (string): the name of the column with the tide heights
+
+    Returns:
+        times, heights
+        times: 1D int64 array of UTC nanoseconds since the epoch, increasing
+        heights: 1D float array, same length
+    """
+    values = np.asarray(raw_tides[use_column], dtype=float)
+    times = raw_tides.index.values.astype('datetime64[ns]').astype(np.int64)
+    seven_hours = np.int64(7 * 60 * 60 * 10**9)
+    ten_seconds = np.int64(10 * 10**9)
+    times = np.concatenate([[times[0] - seven_hours], times,
+                            [times[-1] + ten_seconds,
+                             times[-1] + ten_seconds + seven_hours]])
+    heights = np.concatenate([[values[1]], values, [values[-1], values[-2]]])
+    return times, heights
+
+
+def half_sine_heights(extreme_times, extreme_heights, times):
+    """ Evaluate the half sine tide model at arbitrary times.
+
+    Between two consecutive extremes the tide follows the same half sine
+    wave `sine_interp` samples: h = h1 + (h2 - h1) * (1 - cos(pi * f)) / 2,
+    where f in [0, 1] is the fraction of the interval elapsed.
+
+    Args:
+        extreme_times: 1D increasing array of high/low times (int64 ns)
+        extreme_heights: 1D array of high/low heights, same length
+        times: array-like of query times (int64 ns, same epoch and zone)
+
+    Returns:
+        a float array of heights, NaN for times outside the extremes.
+
+    Examples:
+    >>> half_sine_heights(np.array([0, 4]), np.array([-1.2, -6.2]),
+    ...                   np.array([-1, 0, 1, 2, 3, 4, 5]))
+    array([        nan, -1.2       , -1.93223305, -3.7       , -5.46776695,
+           -6.2       ,         nan])
+    """
+    extreme_times = np.asarray(extreme_times)
+    extreme_heights = np.asarray(extreme_heights, dtype=float)
+    times = np.asarray(times)
+    # interval i runs from extreme i to extreme i + 1
+    i = np.searchsorted(extreme_times, times, side='right') - 1
+    inside = (i >= 0) & (times <= extreme_times[-1])
+    i = np.clip(i, 0, len(extreme_times) - 2)
+    t1, t2 = extreme_times[i], extreme_times[i + 1]
+    h1, h2 = extreme_heights[i], extreme_heights[i + 1]
+    frac = (times - t1) / (t2 - t1).astype(float)
+    heights = h1 + (h2 - h1) * (1. - np.cos(math.pi * frac)) / 2.
+    return np.where(inside, heights, np.nan)
+
+
+def half_sine_fraction(h1, h2, level):
+    """ Where the half sine tide model between extremes h1 and h2 crosses
+    `level`, as a fraction of the time between them (a `fraction` function
+    for intervals.level_crossings).
+
+    Between two extremes h1, h2 the model is h1 + (h2 - h1) * (1 - cos(pi*f))
+    / 2 (see `half_sine_heights`), so it crosses h at
+    f = arccos(1 - 2 * (h - h1) / (h2 - h1)) / pi.
+
+    Examples:
+    >>> half_sine_fraction(np.array([2., -2.]), np.array([-2., 2.]), 1.)
+    array([0.33333333, 0.66666667])
+    """
+    return np.arccos(np.clip(1. - 2. * (level - h1) / (h2 - h1), -1., 1.)
+                     ) / math.pi
+
+
+def threshold_windows(extreme_times, extreme_heights, thresholds, start, stop,
+                      below=True):
+    """ Find when the half sine tide model is below (or above) each of
+    several thresholds, from the high/low extremes only. The crossings of
+    all thresholds are found in one pass, by broadcasting the thresholds
+    against the extremes (see intervals.intervals_above_levels), with the
+    half sine model between extremes (see `half_sine_fraction`).
+
+    Args:
+        extreme_times: 1D increasing array of high/low times (int64 ns)
+        extreme_heights: 1D array of high/low heights, same length
+        thresholds: a float or 1D array of threshold heights
+        start, stop (int64 ns): the time range searched
+    Optional:
+        below (Boolean, default True): find windows below the thresholds if
+            True, above them if False.
+
+    Returns:
+        a list with one (starts, stops) pair of int64 ns arrays per threshold.
+        Windows are clipped to [start, stop].
+
+    Examples:
+    >>> times, heights = np.array([0, 100, 200]), np.array([2., -2., 2.])
+    >>> threshold_windows(times, heights, [0., -3.], 0, 200)
+    [(array([50]), array([150])), (array([], dtype=int64), array([], dtype=int64))]
+    """
+    T = np.asarray(extreme_times, dtype=np.int64)
+    H = np.asarray(extreme_heights, dtype=float)
+    thr = np.atleast_1d(np.asarray(thresholds, dtype=float))
+    start = max(np.int64(start), T[0])
+    stop = min(np.int64(stop), T[-1])
+    # extremes of the intervals overlapping [start, stop]
+    i0 = max(np.searchsorted(T, start, side='right') - 1, 0)
+    i1 = min(np.searchsorted(T, stop, side='left'), len(T) - 1)
+    Ts, Hs = T[i0:i1 + 1], H[i0:i1 + 1]
+    sign = -1. if below else 1.   # below a threshold = above its negative
+
+    windows = []
+    for starts, stops in intervals_above_levels(Ts, sign * Hs, sign * thr,
+                                                half_sine_fraction):
+        starts, stops = np.maximum(starts, start), np.minimum(stops, stop)
+        keep = stops > starts
+        windows.append((starts[keep].astype(np.int64),
+                        stops[keep].astype(np.int64)))
+    return windows
+
+
+def intersect_intervals(starts1, stops1, starts2, stops2):
+    """ Intersect two sets of disjoint time intervals.
+
+    Args:
+        starts1, stops1: arrays of interval bounds, intervals disjoint
+        starts2, stops2: the same for the second set
+
+    Returns:
+        starts, stops: arrays of the intervals covered by both sets,
+        in order. Intersections of zero length are left out.
+
+    Examples:
+    >>> intersect_intervals(np.array([0, 10]), np.array([5, 20]),
+    ...                     np.array([3]), np.array([12]))
+    (array([ 3, 10]), array([ 5, 12]))
+    """
+    bounds = np.concatenate([starts1, starts2, stops1, stops2])
+    steps = np.concatenate([np.ones(len(starts1) + len(starts2), dtype=int),
+                            -np.ones(len(stops1) + len(stops2), dtype=int)])
+    # at equal times, process interval ends before interval starts
+    order = np.lexsort((steps, bounds))
+    bounds, depth = bounds[order], np.cumsum(steps[order])
+    i = np.flatnonzero(depth == 2)     # both sets cover [bounds[i], next]
+    keep = bounds[i + 1] > bounds[i]
+    return bounds[i][keep], bounds[i + 1][keep]
+
+
 
 class Tides:
     """A class with everything related to a NOAA annual tide prediction file.
     Purpose is to store the various input required to graph tides and provide
     station information for a Sun * Moon * Tide calendar.
     """
-    def __init__(self, NOAA_filename):
-        """Take the filename and build everything that needs to be built.
-        After this is done, all attributes are set and everything is ready for
-        plotting and queries.
+    _cache = None       # DiskCache, if Tides were built with a cache
+    _cache_key = None
+
+    def __init__(self, NOAA_filename, resolution=100, max_step=None,
+                 max_error=None, cache=None):
+        """Take the filename (or any other source accepted by
+        `read_noaa_file`, e.g. an in-memory or compressed file) and build
+        everything that needs to be built. After this is done, all attributes
+        are set and everything is ready for plotting and queries.
+
+        NOAA_filename may also be a sequence (or any other iterable) of
+        annual files for the same station, in any order. They are merged into
+        one continuous series with real data across the year boundaries;
+        only the very first and last extremes are padded by `build_all_tides`.
+        Each file is parsed once per process (see `read_noaa_file_cached`).
+
+        Optional arguments set the resolution of the interpolated `all_tides`
+        series, and are passed on to `build_all_tides`:
+            resolution (int > 2, default 100): points per high/low interval,
+                or the upper bound when max_step or max_error is given.
+                The default is high enough for 1-2 highs/lows per day.
+            max_step: longest time step between points, e.g. '10min'.
+            max_error (float): largest error in feet of the straight-line
+                segments drawn between points.
+
+        cache (optional): a cache.DiskCache, or True for the default
+            DiskCache('tides'). The parsed high/lows and header are stored
+            under a hash of the file contents and of station_info.csv, and
+            `all_tides` under that plus the resolution settings, so later
+            runs on the same files skip parsing and interpolation.
+        """
+        if isinstance(NOAA_filename, str) or hasattr(NOAA_filename, 'read'):
+            sources = [NOAA_filename]
+        else:
+            sources = list(NOAA_filename)
+        if not sources:
+            raise ValueError('In Tides, no NOAA annual files were given.')
+        self._set_resolution(resolution, max_step, max_error)
+
+        if cache is True:
+            cache = DiskCache('tides')
+        if cache is not None:
+            contents = [read_source_bytes(source) for source in sources]
+            self._cache = cache
+            self._cache_key = content_key('Tides', sorted(set(
+                hashlib.sha1(c).hexdigest() for c in contents)),
+                station_index().csv_sha1)
+            stored = cache.get_arrays(self._cache_key)
+            if stored is not None:
+                self._set_from_arrays(stored)
+                return
+            sources = [BytesIO(c) for c in contents]
+
+        parsed = [read_noaa_file_cached(source) for source in sources]
+        station_ids = set(meta['Stationid'].strip() for meta, _, _ in parsed)
+        if len(station_ids) > 1:
+            raise ValueError('In Tides, all NOAA annual files must be for the \
+same station. Found station IDs: {}'.format(', '.join(sorted(station_ids))))
+        metadata = parsed[0][0]
+        rawtides = merge_noaa_tables([raw for _, _, raw in parsed])
+        # one year per file, chronological, each once even if its file was
+        # given twice; the first one is the main year
+        self.years = sorted(set(str(raw.index[len(raw) // 2].year)
+                                for _, _, raw in parsed))
+        self._set_station_info(metadata['Stationid'].strip()) # &**& format
+        
+# NOTE: &**& format dependant ... main high/low data column name = 'ft'
+        del rawtides['cm']
+        # localize datetime index, assume ambiguous times are non-DST
+        rawtides.index = rawtides.index.tz_localize(self.timezone,
+                ambiguous = np.zeros(len(rawtides), dtype = bool))
+        self._set_raw_tides(rawtides)
+
+        if self.station_type == 'subordinate':
+            self._set_reference_station_info(metadata)
+
+        self.year = self.years[0]
+
+        if cache is not None:
+            ns = self.raw_tides.index.values.astype('datetime64[ns]')
+            cache.put_arrays(self._cache_key,
+                             times = ns.astype(np.int64),
+                             ft = self.raw_tides['ft'].values,
+                             high_low = np.array(self.raw_tides['High/Low'],
+                                                 dtype = str),
+                             years = np.array(self.years),
+                             metadata = np.array(json.dumps(metadata)))
+
+    def _set_from_arrays(self, stored):
+        """Set everything from arrays stored in the cache by __init__."""
+        metadata = json.loads(str(stored['metadata']))
+        self.years = [str(y) for y in stored['years']]
+        self._set_station_info(metadata['Stationid'].strip()) # &**& format
+        index = pd.DatetimeIndex(stored['times'].astype('datetime64[ns]'),
+                                 name = 'TimeIndex')
+        rawtides = pd.DataFrame({'ft': stored['ft'],
+                                 'High/Low': stored['high_low'].astype(object)},
+                                index = index.tz_localize('UTC'),
+                                columns = ['ft', 'High/Low'])
+        self._set_raw_tides(rawtides)
+        if self.station_type == 'subordinate':
+            self._set_reference_station_info(metadata)
+        self.year = self.years[0]
+
+    @classmethod
+    def from_reference(cls, reference, offsets, resolution=None,
+                       max_step=None, max_error=None):
+        """Derive subordinate station Tides from a reference station's Tides,
+        without reading a NOAA file per subordinate station.
+
+        Each high (low) of the reference station is shifted by the
+        subordinate's high (low) time offset and corrected by its high (low)
+        height offset, the way NOAA derives subordinate predictions. All
+        stations and all extremes are corrected at once with array
+        broadcasting.
+
+        Args:
+            reference: a Tides object for the reference station
+            offsets: a pandas DataFrame with one row per subordinate station,
+                indexed by StationID (or with a 'StationID' column), and
+                columns named as in the NOAA file header: TimeOffsetHigh,
+                TimeOffsetLow (minutes, + or -), HeightOffsetHigh,
+                HeightOffsetLow. Height offsets are multiplicative ratios
+                (numbers, or strings like '*0.97' as in the NOAA header) or
+                additive offsets in feet (strings starting with '+' or '-').
+                The stations must be present in station_info.csv.
+
+        Optional:
+            resolution, max_step, max_error: as for Tides(); by default the
+                reference station's settings are used.
+
+        Returns:
+            a dict of {StationID: Tides}, in the order of `offsets`.
+        """
+        if 'StationID' in offsets.columns:
+            offsets = offsets.set_index('StationID')
+        station_ids = [str(st_id) for st_id in offsets.index]
+
+        def _minutes(column):
+            return np.array([float(str(v).strip()) for v in offsets[column]])
+
+        time_high = _minutes('TimeOffsetHigh')[:, np.newaxis]
+        time_low = _minutes('TimeOffsetLow')[:, np.newaxis]
+        ratio_high, add_high = parse_height_offsets(offsets['HeightOffsetHigh'])
+        ratio_low, add_low = parse_height_offsets(offsets['HeightOffsetLow'])
+
+        # reference extremes: one row per subordinate, one column per extreme
+        ref = reference.raw_tides
+        is_high = (ref['High/Low'].values == 'H')      # &**& 'H'/'L'
+        ref_ns = ref.index.values.astype('datetime64[ns]').astype(np.int64)
+        ref_ft = ref['ft'].values                       # &**& 'ft'
+        minute = 60 * 10**9
+        times = ref_ns + (np.where(is_high, time_high, time_low)
+                          * minute).round().astype(np.int64)
+        heights = np.where(is_high, ref_ft * ratio_high[:, np.newaxis]
+                                    + add_high[:, np.newaxis],
+                                    ref_ft * ratio_low[:, np.newaxis]
+                                    + add_low[:, np.newaxis])
+
+        if resolution is None:
+            resolution = reference._resolution
+            max_step = reference._max_step
+            max_error = reference._max_error
+
+        derived = collections.OrderedDict()
+        for i, st_id in enumerate(station_ids):
+            tide = cls.__new__(cls)
+            tide._set_station_info(st_id)
+            tide.station_type = 'subordinate'   # whatever the lookup says
+            tide._set_resolution(resolution, max_step, max_error)
+            index = pd.DatetimeIndex(times[i].astype('datetime64[ns]'),
+                                     name = ref.index.name)
+            rawtides = pd.DataFrame({'ft': heights[i],
+                                     'High/Low': ref['High/Low'].values},
+                                    index = index.tz_localize('UTC'),
+                                    columns = ['ft', 'High/Low'])
+            tide._set_raw_tides(rawtides.sort_index(kind='mergesort'))
+            row = offsets.iloc[i]
+            metadata = {'ReferenceToStationId': reference.station_id,
+                        'TimeOffsetHigh': str(row['TimeOffsetHigh']),
+                        'TimeOffsetLow': str(row['TimeOffsetLow']),
+                        'HeightOffsetHigh': str(row['HeightOffsetHigh']),
+                        'HeightOffsetLow': str(row['HeightOffsetLow'])}
+            tide._set_reference_station_info(metadata)
+            tide.years = list(reference.years)
+            tide.year = reference.year
+            derived[st_id] = tide
+        return derived
+
+    @classmethod
+    def from_harmonics(cls, source, years, resolution=100, max_step=None,
+                       max_error=None, step='6min'):
+        """Build Tides from a station's harmonic constituents instead of a
+        NOAA annual file, for any year(s). Heights are predicted on a time
+        grid and the highs and lows extracted (see harmonics.py); everything
+        after that, from `all_tides` to calendar drawing, is unchanged.
+
+        Args:
+            source: a harmonic constituent file, in the format described in
+                `harmonics.read_harmonic_file` (path, file object, gz, zip)
+            years: a year or a sequence of years, e.g. 2031 or ['2031',
+                '2032']. Like NOAA annual files, predictions start on Dec 31
+                of the year before and end on Dec 31 of the last year.
+
+        Optional:
+            resolution, max_step, max_error: as for Tides()
+            step: time step of the prediction grid used to find the highs and
+                lows (default 6 minutes); extremes are refined between steps.
         """
-        metadata, col_names = read_noaa_header(NOAA_filename)
-        self.station_id = metadata['Stationid'].strip() # &**& format dependant
+        from harmonics import read_harmonic_file, predict_extremes
+        metadata, constituents = read_harmonic_file(source)
+        if isinstance(years, (str, int)):
+            years = [years]
+        first, last = min(int(y) for y in years), max(int(y) for y in years)
+
+        tide = cls.__new__(cls)
+        tide._set_resolution(resolution, max_step, max_error)
+        tide._set_station_info(metadata['Stationid'])
+        tide.station_type = 'harmonic'    # predicted from its own constants
+        start = pd.Timestamp('{}-12-31'.format(first - 1))
+        stop = pd.Timestamp('{}-01-01'.format(last + 1))
+        start, stop = pd.DatetimeIndex([start, stop]).tz_localize(tide.timezone)
+        rawtides = predict_extremes(constituents, float(metadata['Z0']),
+                                    start, stop, step)
+        tide._set_raw_tides(rawtides)
+        tide.years = [str(y) for y in range(first, last + 1)]
+        tide.year = tide.years[0]
+        return tide
+
+    def _set_station_info(self, station_id):
+        """Set the station attributes, looked up in station_info.csv."""
+        self.station_id = station_id
         info = lookup_station_info(self.station_id)
         self.station_name = info['name']
         self.state = info['state']
@@ -315,38 +1289,176 @@ class Tides:
         self.longitude = info['longitude']
         self.station_type = info['st_type'].lower()
         self.timezone = info['timezone']
-        num_rows_to_skip = len(metadata) + 2
-        resolution = 100     # hi res set for cases of 1-2 highs/lows per day
-        
-# ------------ Read annual tide table into pandas DataFrame--------------
-# NOTE: &**& format dependant ... main high/low data column name = 'ft'
-        rawtides = pd.read_csv(NOAA_filename,
-                       names = ['Date', 'Day', 'Time', 'AM/PM', 
-                                'ft', 'cm', 'High/Low'],
-                       delim_whitespace = 1, skiprows = num_rows_to_skip,
-                       parse_dates = {'TimeIndex' :
-                                        ['Date', 'Day', 'Time', 'AM/PM']},
-                       index_col=0)
-        del rawtides['High/Low']
-        del rawtides['cm']
-        # localize datetime index, assume ambiguous times are non-DST
-        rawtides.index = rawtides.index.tz_localize(self.timezone,
-                ambiguous = np.zeros(len(rawtides), dtype = bool))
-        # convert to UTC for calculations        
-        rawtides.index = rawtides.index.tz_convert('UTC')
-        self.all_tides = build_all_tides(rawtides, resolution, 'ft',
-                                         extend_ends = True) # &**& 'ft'
-        self.all_tides.index = self.all_tides.index.tz_convert(self.timezone)
-        # back to local time, ready for plotting        
+
+    def _set_resolution(self, resolution, max_step, max_error):
+        """Remember the `all_tides` resolution settings, see __init__."""
+        self._resolution = resolution
+        self._max_step = max_step
+        self._max_error = max_error
+
+    def _set_raw_tides(self, rawtides):
+        """Set the high/low table and everything derived from it. Argument:
+        DataFrame with a tz-aware index (any zone) and columns 'ft' and
+        'High/Low'. &**& 'ft'"""
+        # extremes as plain UTC arrays for on-demand evaluation; the
+        # interpolated all_tides series is only built if someone asks for it
+        self._extreme_times, self._extreme_heights = padded_extremes(
+                                                     rawtides, 'ft')
+        self._all_tides = None
+        # local time, ready for plotting
         rawtides.index = rawtides.index.tz_convert(self.timezone)
         self.raw_tides = rawtides
+        self.annual_max = max(rawtides.ft)
+        self.annual_min = min(rawtides.ft)
 
-        if self.station_type == 'subordinate':
-            self._set_reference_station_info(metadata)
+    @property
+    def all_tides(self):
+        """pandas timeseries of sine interpolated tides in local time, from
+        `build_all_tides`. Built on first access (or loaded from the cache
+        Tides were built with) and then kept; prefer `heights_at` or `curve`
+        when only some times are needed.
+        """
+        if self._all_tides is not None:
+            return self._all_tides
+
+        key = None
+        if self._cache is not None:
+            key = content_key(self._cache_key, self._resolution,
+                              self._max_step, self._max_error)
+            stored = self._cache.get_arrays(key)
+            if stored is not None:
+                index = pd.DatetimeIndex(
+                    stored['times'].astype('datetime64[ns]')).tz_localize('UTC')
+                self._all_tides = pd.Series(stored['heights'],
+                                            index.tz_convert(self.timezone))
+                return self._all_tides
+
+        rawtides = self.raw_tides.copy()
+        # convert to UTC for calculations
+        rawtides.index = rawtides.index.tz_convert('UTC')
+        all_tides = build_all_tides(rawtides, self._resolution, 'ft',
+                                    extend_ends = True,  # &**& 'ft'
+                                    max_step = self._max_step,
+                                    max_error = self._max_error)
+        if key is not None:
+            ns = all_tides.index.values.astype('datetime64[ns]')
+            self._cache.put_arrays(key, times = ns.astype(np.int64),
+                                   heights = all_tides.values)
+        # back to local time, ready for plotting
+        all_tides.index = all_tides.index.tz_convert(self.timezone)
+        self._all_tides = all_tides
+        return self._all_tides
+
+    def _localize(self, times):
+        """Return `times` (anything pandas.DatetimeIndex accepts) as a
+        DatetimeIndex in the station time zone. Naive times are taken to be
+        station local time; ambiguous times are assumed to be non-DST, as for
+        the NOAA tables."""
+        times = pd.DatetimeIndex(times)
+        if times.tz is None:
+            times = times.tz_localize(self.timezone,
+                        ambiguous = np.zeros(len(times), dtype = bool))
+        return times.tz_convert(self.timezone)
+
+    def heights_at(self, times):
+        """Tide heights (ft) at the given times, evaluated on demand from
+        the high/low extremes with the same half sine model as `all_tides`.
+
+        Args:
+            times: a list/array of datetimes, Timestamps or date strings, or
+                   a DatetimeIndex. Naive times are station local time.
+
+        Returns:
+            a pandas Series of heights indexed by the times (station time
+            zone). NaN outside the range covered by the tide tables.
+        """
+        times = self._localize(times)
+        utc_ns = times.tz_convert('UTC').values.astype('datetime64[ns]')
+        heights = half_sine_heights(self._extreme_times, self._extreme_heights,
+                                    utc_ns.astype(np.int64))
+        return pd.Series(heights, times)
+
+    def curve(self, start, stop, n):
+        """Tide heights at `n` evenly spaced times from `start` to `stop`
+        (both included), e.g. to plot a single day without building
+        `all_tides`. Naive start/stop are station local time.
+
+        Returns a pandas Series as `heights_at` does.
+        """
+        start, stop = self._localize([start, stop])
+        utc = pd.DatetimeIndex([start, stop]).tz_convert('UTC')
+        ns = utc.values.astype('datetime64[ns]').astype(np.int64)
+        grid = np.linspace(ns[0], ns[1], n).round().astype(np.int64)
+        times = pd.DatetimeIndex(grid.astype('datetime64[ns]'))
+        return self.heights_at(times.tz_localize('UTC'))
+
+    def windows(self, threshold, below=True, start=None, stop=None,
+                sun=None, min_sun_altitude=0.):
+        """Time windows when the tide is below (or above) a threshold, e.g.
+        all daylight lows below -1 ft this year. Crossing times come straight
+        from the half sine model between the high/low extremes; `all_tides`
+        is not needed.
+
+        Args:
+            threshold (float): tide height in feet
+        Optional:
+            below (Boolean, default True): windows below the threshold if
+                True, above it if False.
+            start, stop: time range searched (anything pandas.Timestamp
+                accepts; naive times are station local time). Default: the
+                whole range of the tide tables.
+            sun: an astro.Astro object for 'Sun' (or any other body). If
+                given, only the parts of windows when the body is higher than
+                min_sun_altitude (degrees, default 0) are returned.
+
+        Returns:
+            a pandas DataFrame with columns 'start', 'stop' (station time
+            zone) and 'duration', one row per window.
+        """
+        found = self.windows_batch([threshold], below, start, stop, sun,
+                                   min_sun_altitude)
+        del found['threshold']
+        return found
+
+    def windows_batch(self, thresholds, below=True, start=None, stop=None,
+                      sun=None, min_sun_altitude=0.):
+        """Like `windows`, for many thresholds at once. The crossings of all
+        thresholds are computed together, and the sun intervals only once.
+
+        Returns a pandas DataFrame with columns 'threshold', 'start', 'stop'
+        and 'duration', sorted by threshold (in the given order), then time.
+        """
+        if start is None:
+            start = self.raw_tides.index[0]
+        if stop is None:
+            stop = self.raw_tides.index[-1]
+        bounds = self._localize([start, stop]).tz_convert('UTC')
+        start_ns, stop_ns = bounds.values.astype('datetime64[ns]').astype(
+                                                                  np.int64)
+        found = threshold_windows(self._extreme_times, self._extreme_heights,
+                                  thresholds, start_ns, stop_ns, below)
+        if sun is not None:
+            up = sun.intervals_above(min_sun_altitude, bounds[0], bounds[1])
+            up_starts, up_stops = [
+                pd.DatetimeIndex(up[c]).tz_convert('UTC').values.astype(
+                    'datetime64[ns]').astype(np.int64)
+                for c in ['start', 'stop']]
+            found = [intersect_intervals(starts, stops, up_starts, up_stops)
+                     for starts, stops in found]
 
-        self.year = str(self.raw_tides.index[100].year)
-        self.annual_max = max(rawtides.ft)     # &**& 'ft'
-        self.annual_min = min(rawtides.ft)     # &**& 'ft'
+        thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+        counts = [len(starts) for starts, _ in found]
+        starts = np.concatenate([s for s, _ in found]).astype(np.int64)
+        stops = np.concatenate([s for _, s in found]).astype(np.int64)
+        def _to_local(ns):
+            index = pd.DatetimeIndex(ns.astype('datetime64[ns]'))
+            return index.tz_localize('UTC').tz_convert(self.timezone)
+        result = pd.DataFrame({'threshold': np.repeat(thresholds, counts),
+                               'start': _to_local(starts),
+                               'stop': _to_local(stops)},
+                              columns = ['threshold', 'start', 'stop'])
+        result['duration'] = result['stop'] - result['start']
+        return result
 
     def _set_reference_station_info(self,metadata):
         """Set attributes for reference station information, if station type
@@ -356,11 +1468,14 @@ class Tides:
         self.ref_station_id = metadata['ReferenceToStationId'].strip()
         ref_info = lookup_station_info(self.ref_station_id)
         self.ref_station_name = ref_info['name']
-        # height offsets are a multiplicative factor - convert to %
-        hol = metadata['HeightOffsetLow'].strip('*').strip()
-        self.height_offset_low = round(float(hol) * 100)
-        hoh = metadata['HeightOffsetHigh'].strip('*').strip()
-        self.height_offset_high = round(float(hoh) * 100)
+        # height offsets are a multiplicative factor - convert to % - or an
+        # addition in feet (see parse_height_offsets)
+        ratios, additions = parse_height_offsets(
+            [metadata['HeightOffsetHigh'], metadata['HeightOffsetLow']])
+        self.height_offset_high = round(float(ratios[0]) * 100)
+        self.height_offset_low = round(float(ratios[1]) * 100)
+        self.height_addition_high = float(additions[0])
+        self.height_addition_low = float(additions[1])
         # time offsets are in minutes + or -
         self.time_offset_low = metadata['TimeOffsetLow'].strip()
         self.time_offset_high = metadata['TimeOffsetHigh'].strip()